@@ -1,5 +1,14 @@
 
 from .evdump import evdump as evdump
 from .rec import rec_digits as rec_digits
+from .recorder import record as record
+from .replay import replay as replay
+from .digits import DigitSink as DigitSink
+from .digits import DigitFileWriter as DigitFileWriter
+from .digits import read_digits as read_digits
+from .tracklets import TrackletSink as TrackletSink
+from .tracklets import TrackletFileWriter as TrackletFileWriter
+from .tracklets import read_tracklets as read_tracklets
+from .geometry import pad_coordinates as pad_coordinates
 # from .trdfeeparser import TrdFeeParser
 # from .trdfeeparser import check_dword, logflt
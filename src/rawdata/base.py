@@ -48,22 +48,28 @@ class DumpParser(BaseParser):
 
 
 class BaseHeader:
+    """Base class for headers with a BitStruct layout
+
+    Headers only keep a reference to their raw data. The fields are
+    unpacked on first access (see BitStruct), and the descriptions for
+    hexdumps are only rendered by hexdump_desc(). Subclasses should define
+    __slots__ as well."""
+
+    __slots__ = ('_addr', '_data', '_values')
+
     header_size = 0
     _hexdump_fmt = ('\033[1;37;40m', '\033[0;37;100m')
     _hexdump_desc = ("")
 
     def __init__(self, data, addr):
-        if not isinstance(data, bytes) or len(data) != self.header_size:
+        if not isinstance(data, (bytes, memoryview)) or len(data) != self.header_size:
             raise TypeError(
                 f"Invalid DataHeader raw data format {type(data)} {len(data)}")
 
         self._addr = addr
         self._data = data
-        # print(self.keys())
-        # print(self.unpack(data))
-        for k, v in zip(self.keys(), self.unpack(data)):
-            setattr(self,k,v)
-        
+        self._values = None
+
     @classmethod
     def read(cls, stream):
         addr = stream.tell()
@@ -73,13 +79,20 @@ class BaseHeader:
         # header.hexdump()
         return header
 
+    def asdict(self):
+        """Return the fields of the header as a dict"""
+        return dict(zip(self.keys(), self.unpack(self._data)))
+
+    def hexdump_desc(self):
+        """Render the descriptions of the 32-bit words of the header"""
+        fields = self.asdict()
+        return [d.format(**fields) for d in self._hexdump_desc]
+
     def hexdump(self, logger):
+        descriptions = self.hexdump_desc()
         for i, words in enumerate(struct.iter_unpack("<L", self._data)):
 
-            if len(self._hexdump_desc) == 1:
-                desc = self._hexdump_desc
-            else:
-                desc = self._hexdump_desc[i]
+            desc = descriptions[i] if i < len(descriptions) else ""
 
             if len(self._hexdump_fmt) == 1:
                 fmt = self._hexdump_fmt[0]
@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 
 from collections import namedtuple, Counter, OrderedDict
-import itertools
 import struct
+import numpy as np
 import logging
 
 class BitStructWord:
@@ -78,22 +78,38 @@ def bitgroups(fieldinfo, bitwidth=32):
 
 
 class BitStruct:
-    "A struct with fields that can be less than a byte wide"
+    """A struct with fields that can be less than a byte wide
+
+    The layout is translated into the source code of an unpack(data)
+    function, which unpacks all words with one precompiled struct.Struct
+    and extracts the fields with inline shifts and masks. Decorated classes
+    (see BaseHeader) get a property for every field, which unpacks the
+    header on first access.
+
+    For many headers at once, unpack_array(buffer, offsets) returns a NumPy
+    structured array of `dtype`, with one column per field."""
 
     _fmtchar_map = {8: "B", 16: "H", 32: "L", 64: "Q"}
+    _nptype_map = {"B": "u1", "H": "<u2", "L": "<u4", "Q": "<u8"}
+
+    _fieldinfo_t = namedtuple("fieldinfo_t", ["name", "size", "word", "shift", "mask"])
 
     def __init__(self, **fieldinfo):
 
         self._fmt = "<"
-        self._fmtdecoder = list()
         self._keys = list()
 
+        # location of the fields in the words w0, w1, ... - fields that
+        # fill a whole word have no mask
+        self._fields = list()
+
         bitstruct = None
         for name, size in fieldinfo.items():
+            word = len(self._fmt)-1
             if bitstruct is None and size in self._fmtchar_map:
                 # we can use a simple struct.unpack() to extract this field
                 self._fmt += self._fmtchar_map[size]
-                self._fmtdecoder.append(lambda x: [x])
+                self._fields.append(self._fieldinfo_t(name, size, word, 0, None))
                 self._keys.append(name)
             else:
                 # either we have a field that is not a multiple of 8 bits wide,
@@ -110,31 +126,96 @@ class BitStruct:
                 # if we can parse the fields up to here, let's do it
                 if bitstruct.parseable:
                     self._fmt += bitstruct.fmtchar
-                    self._fmtdecoder.append(bitstruct.unpack)
+                    for p, e in zip(bitstruct._partinfo, bitstruct._extractinfo):
+                        self._fields.append(self._fieldinfo_t(
+                            p.name, p.size, word, e.shift, e.mask))
                     bitstruct = None
 
+        self._struct = struct.Struct(self._fmt)
         self._fmthexdesc = auto_hexdump_str(fieldinfo)
-
+        self.unpack, self._getters = self._compile()
+
+        # NumPy types of the packed words, and of the unpacked fields
+        self._worddtype = np.dtype([
+            (f"w{i}", self._nptype_map[c]) for i, c in enumerate(self._fmt[1:])])
+        self.dtype = np.dtype([
+            (f.name, next(t for b, t in ((8, "u1"), (16, "<u2"), (32, "<u4"), (64, "<u8"))
+                          if f.size <= b))
+            for f in self._fields])
+
+    def _compile(self):
+        """Generate the unpack functions for this layout"""
+
+        exprs = list()
+        for f in self._fields:
+            expr = f"w{f.word}"
+            if f.shift:
+                expr = f"({expr} >> {f.shift})"
+            if f.mask is not None:
+                expr = f"{expr} & 0x{f.mask:X}"
+            exprs.append(expr)
+
+        words = "".join(f"w{i}, " for i in range(len(self._fmt)-1))
+        self._source = "\n".join((
+            f"def unpack(data):",
+            f"    {words}= _unpack(data)",
+            f"    return ({''.join(e + ', ' for e in exprs)})",
+            f"",
+            *(line for i in range(len(exprs)) for line in (
+                f"def get{i}(self):",
+                f"    v = self._values",
+                f"    if v is None:",
+                f"        v = self._values = unpack(self._data)",
+                f"    return v[{i}]",
+                f"")),
+            ))
+
+        namespace = dict(_unpack=self._struct.unpack)
+        exec(compile(self._source, f"<BitStruct {self._fmt}>", "exec"), namespace)
+        return namespace['unpack'], [namespace[f"get{i}"] for i in range(len(exprs))]
 
     def __call__(self, klass):
         """Decorator to teach classes to parse a BitStruct"""
 
-        klass.unpack = self.unpack
+        klass.unpack = staticmethod(self.unpack)
+        for name, getter in zip(self._keys, self._getters):
+            setattr(klass, name, property(getter))
+        klass.unpack_array = staticmethod(self.unpack_array)
+        klass.dtype = self.dtype
         klass.keys = self.keys
-        klass.header_size = struct.calcsize(self._fmt)
+        klass.header_size = self._struct.size
 
-        try:
-            klass._hexdump_desc
-        except AttributeError:
-            klass._hexdump_desc = self._fmthexdesc
+        if '_hexdump_desc' not in vars(klass):
+            klass._hexdump_desc = tuple(self._fmthexdesc)
 
         return klass
 
-    def unpack(self, data):
-        return tuple( itertools.chain.from_iterable(
-            decode(value)
-            for decode, value 
-            in zip(self._fmtdecoder, struct.unpack(self._fmt, data))) )
+    def unpack_array(self, buffer, offsets):
+        """Unpack the headers at the given byte offsets of a buffer
+
+        Returns a structured array of `dtype` with one entry per offset."""
+
+        data = np.frombuffer(buffer, dtype=np.uint8)
+        offsets = np.asarray(offsets, dtype=np.intp)
+        size = self._struct.size
+
+        if len(offsets) > 0 and (offsets.min() < 0 or offsets.max() + size > len(data)):
+            raise ValueError("header offsets outside of the buffer")
+
+        # gather the header bytes, and reinterpret them as packed words
+        raw = data[offsets[:, np.newaxis] + np.arange(size)]
+        words = raw.view(self._worddtype).reshape(len(offsets))
+
+        result = np.empty(len(offsets), dtype=self.dtype)
+        for f in self._fields:
+            w = words[f"w{f.word}"]
+            if f.shift:
+                w = w >> f.shift
+            if f.mask is not None:
+                w = w & f.mask
+            result[f.name] = w
+
+        return result
 
     def keys(self):
         return self._keys
@@ -0,0 +1,177 @@
+#!/usr/bin/env python3
+#
+# Multi-threaded decompression of bzip2 files
+#
+# A bzip2 file consists of one or more streams, each with a header `BZh1`
+# to `BZh9`, a number of independently compressed blocks, and an
+# end-of-stream marker with a combined CRC. The blocks start with a 48-bit
+# magic number, but they are not aligned to byte boundaries. To decompress
+# them in parallel, the blocks are located by a bit-wise search, shifted to
+# byte boundaries and wrapped into streams of their own, which the bz2
+# module decompresses in a pool of threads (it releases the GIL).
+#
+# If a block cannot be decompressed, e.g. because the magic number was
+# found by chance in compressed data, the rest of the file is decompressed
+# sequentially.
+
+import bz2
+import io
+import logging
+import mmap
+import os
+from concurrent.futures import ThreadPoolExecutor
+from collections import deque
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_block_magic = 0x314159265359
+_eos_magic = 0x177245385090
+
+
+def find_pattern(data, pattern):
+    """Find the bit positions of a 48-bit pattern in a buffer"""
+
+    positions = list()
+    for shift in range(8):
+        if shift == 0:
+            needle = pattern.to_bytes(6, "big")
+            pos = data.find(needle)
+            while pos >= 0:
+                positions.append(8*pos)
+                pos = data.find(needle, pos+1)
+            continue
+
+        # the pattern spans 7 bytes, the 5 bytes in the middle are complete
+        full = (pattern << (8-shift)).to_bytes(7, "big")
+        first_mask = (1 << (8-shift)) - 1
+        last_mask = (0xFF << (8-shift)) & 0xFF
+        needle = full[1:6]
+
+        pos = data.find(needle, 1)
+        while 0 <= pos < len(data)-5:
+            if (data[pos-1] & first_mask) == full[0] \
+               and (data[pos+5] & last_mask) == full[6]:
+                positions.append(8*(pos-1) + shift)
+            pos = data.find(needle, pos+1)
+
+    return sorted(positions)
+
+
+def find_blocks(data):
+    """Return the bit ranges (start, end) of all blocks in a bzip2 buffer"""
+
+    starts = find_pattern(data, _block_magic)
+    ends = set(find_pattern(data, _eos_magic))
+
+    boundaries = sorted(ends.union(starts))
+    nextpos = dict(zip(boundaries, boundaries[1:]))
+    return [(s, nextpos[s]) for s in starts if s in nextpos]
+
+
+def block_stream(data, start, end):
+    """Wrap the block at bits [start, end) of data into a bzip2 stream"""
+
+    shift = start % 8
+    nbits = end - start
+
+    first = start // 8
+    last = min((end+7)//8 + 1, len(data))
+    raw = np.frombuffer(data, dtype=np.uint8, count=last-first, offset=first)
+    if shift:
+        raw = np.append(raw, np.uint8(0))
+        aligned = (raw[:-1] << shift) | (raw[1:] >> (8-shift))
+    else:
+        aligned = raw
+
+    nfull, nrem = divmod(nbits, 8)
+
+    # the stream CRC of a single block is the CRC of the block
+    crc = int.from_bytes(aligned[6:10].tobytes(), "big")
+    partial = int(aligned[nfull]) >> (8-nrem) if nrem else 0
+
+    # the remaining bits of the block, the end-of-stream marker and the CRC
+    tail = (((partial << 48) | _eos_magic) << 32) | crc
+    tailbits = nrem + 80
+    pad = -tailbits % 8
+    tail = (tail << pad).to_bytes((tailbits+pad)//8, "big")
+
+    return b"BZh9" + aligned[:nfull].tobytes() + tail
+
+
+class ParallelBZ2Reader(io.RawIOBase):
+    """Binary stream with the decompressed content of a bzip2 file
+
+    The blocks are decompressed in `threads` threads (default: number of
+    CPUs), the output is handed out in chunks of whole blocks."""
+
+    def __init__(self, filename, threads=None):
+        self.filename = filename
+        self.threads = threads if threads is not None else (os.cpu_count() or 1)
+        self.chunks = self._decompress()
+        self.current = memoryview(b"")
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while self.pos == len(self.current):
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                return 0
+            self.current = memoryview(chunk)
+            self.pos = 0
+
+        n = min(len(buffer), len(self.current) - self.pos)
+        buffer[:n] = self.current[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def _decompress(self):
+        produced = 0
+        try:
+            with open(self.filename, "rb") as f:
+                if os.fstat(f.fileno()).st_size == 0:
+                    return
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+            blocks = find_blocks(data)
+            pending = deque()
+            with ThreadPoolExecutor(self.threads) as pool:
+                for start, end in blocks:
+                    pending.append(pool.submit(
+                        lambda s, e: bz2.decompress(block_stream(data, s, e)),
+                        start, end))
+                    if len(pending) > 2*self.threads:
+                        chunk = pending.popleft().result()
+                        produced += len(chunk)
+                        yield chunk
+
+                while len(pending) > 0:
+                    chunk = pending.popleft().result()
+                    produced += len(chunk)
+                    yield chunk
+
+            if len(blocks) > 0:
+                return
+
+        except (OSError, EOFError, ValueError) as e:
+            logger.warning(f"parallel decompression of {self.filename} failed "
+                           f"({e}), continuing sequentially")
+
+        # sequential fallback, skipping what has been handed out already
+        with bz2.open(self.filename, "rb") as f:
+            f.seek(produced)
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                yield chunk
+
+
+def open_bz2(filename, threads=None, encoding="utf-8"):
+    """Open a bzip2-compressed text file for multi-threaded decompression"""
+
+    raw = ParallelBZ2Reader(filename, threads)
+    return io.TextIOWrapper(io.BufferedReader(raw, 1 << 20), encoding=encoding)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+#
+# Columnar storage of decoded data
+#
+# Digits and tracklets are stored as chunks: NamedTuples with one NumPy
+# array per column, where the first column is the event number. The sink
+# and file classes here work for any such NamedTuple, given a second
+# instance of it that holds the dtypes of the columns. The NamedTuple has to
+# provide the number of rows as `nrows`, len() is the number of columns.
+
+import os
+import shutil
+import struct
+import tempfile
+import numpy as np
+
+
+class ColumnSink:
+    """Collect rows in growable NumPy columns and hand them out in chunks
+
+    The callback is called with an instance of `chunk_type` whenever a
+    chunk is complete: with chunk_size=None at the end of every event,
+    otherwise as soon as at least chunk_size rows have been collected. The
+    columns of a chunk are not reused afterwards. flush() has to be called
+    after the last event to hand out the remaining rows.
+
+    Columns can have more than one dimension, e.g. the ADC values of
+    digits. All rows in a chunk have the same shape. If it changes, the
+    current chunk is handed out and a new one is started."""
+
+    def __init__(self, chunk_type, dtypes, callback, chunk_size=None, capacity=1024):
+        self.chunk_type = chunk_type
+        self.dtypes = dtypes
+        self.callback = callback
+        self.chunk_size = chunk_size
+        self.capacity = capacity
+        self.shapes = None
+        self.size = 0
+        self.columns = None
+
+    def _allocate(self, capacity):
+        columns = self.chunk_type(*(np.empty((capacity,) + shape, dtype=dt)
+                                    for dt, shape in zip(self.dtypes, self.shapes)))
+
+        # keep the rows that have been collected so far
+        if self.columns is not None:
+            for new, old in zip(columns, self.columns):
+                new[:self.size] = old[:self.size]
+
+        self.columns = columns
+
+    def append(self, n, *values):
+        """Store n rows
+
+        Every value is either a scalar, which is stored in all n rows, or
+        an array with n rows."""
+
+        event = values[0] if np.ndim(values[0]) == 0 else values[0][0]
+        if self.size > 0 and self.chunk_size is None \
+           and event != self.columns[0][self.size-1]:
+            self.flush()
+
+        shapes = tuple(np.shape(v)[1:] for v in values)
+        if shapes != self.shapes:
+            self.flush()
+            self.shapes = shapes
+            self.columns = None
+
+        if self.columns is None or self.size + n > len(self.columns[0]):
+            self._allocate(max(2*len(self.columns[0]), self.size + n)
+                           if self.columns is not None else max(self.capacity, n))
+
+        s, e = self.size, self.size + n
+        for col, v in zip(self.columns, values):
+            col[s:e] = v
+        self.size = e
+
+        if self.chunk_size is not None and self.size >= self.chunk_size:
+            self.flush()
+
+    def store_chunk(self, chunk):
+        """Append a chunk from another sink"""
+
+        n = chunk.nrows
+        if n > 0:
+            self.append(n, *chunk)
+
+    def flush(self):
+        """Hand out the rows collected so far"""
+
+        if self.size == 0:
+            return
+
+        chunk = self.chunk_type(*(c[:self.size] for c in self.columns))
+        self.columns = None
+        self.size = 0
+        self.callback(chunk)
+
+
+class ColumnFile:
+    """Layout of a binary file with the columns of a chunk type
+
+    The file starts with a header of 128 bytes: magic, format version, the
+    sizes of the extra dimensions of columns (`shapes` maps column names to
+    names of these sizes), the number of rows and the byte offsets of the
+    columns. The columns follow as contiguous little-endian arrays, every
+    one aligned to 64 bytes, so they can be mapped into memory without
+    parsing."""
+
+    header_size = 128
+    align = 64
+
+    def __init__(self, chunk_type, dtypes, magic, version=1, shapes=None, name="column"):
+        self.chunk_type = chunk_type
+        self.dtypes = dtypes
+        self.magic = magic
+        self.version = version
+        self.shapes = shapes or dict()
+        self.name = name
+
+        self.dims = list()
+        for dims in self.shapes.values():
+            self.dims.extend(d for d in dims if d not in self.dims)
+
+        self.header = struct.Struct(
+            f"<8sI{len(self.dims)}IQ{len(chunk_type._fields)}Q")
+
+    def row_shape(self, field, dims):
+        return tuple(dims[d] for d in self.shapes.get(field, ()))
+
+    def read(self, filename):
+        """Map a file into memory
+
+        Returns a chunk whose columns are read-only NumPy views of the file."""
+
+        with open(filename, "rb") as f:
+            header = f.read(self.header.size)
+
+        if len(header) < self.header.size or header[:8] != self.magic:
+            raise ValueError(f"{filename} is not a {self.name} file")
+
+        _, version, *values = self.header.unpack(header)
+        if version != self.version:
+            raise ValueError(f"unsupported {self.name} file version {version}")
+
+        dims = dict(zip(self.dims, values))
+        nrows = values[len(self.dims)]
+        offsets = values[len(self.dims)+1:]
+
+        data = np.memmap(filename, dtype=np.uint8, mode="r")
+        columns = list()
+        for field, dt, offset in zip(self.chunk_type._fields, self.dtypes, offsets):
+            shape = (nrows,) + self.row_shape(field, dims)
+            columns.append(np.frombuffer(data, dtype=dt, count=int(np.prod(shape)),
+                                         offset=offset).reshape(shape))
+
+        return self.chunk_type(*columns)
+
+
+class ColumnFileWriter:
+    """Write chunks (see ColumnSink) to a binary file (see ColumnFile)
+
+    The number of rows is only known at the end, so the columns are
+    collected in temporary files next to the output file and assembled by
+    close(). All rows in a file must have the same shape."""
+
+    def __init__(self, layout, filename):
+        self.layout = layout
+        self.filename = filename
+        tmpdir = os.path.dirname(os.path.abspath(filename))
+        self.columns = [tempfile.TemporaryFile(dir=tmpdir)
+                        for _ in layout.chunk_type._fields]
+        self.dims = None
+        self.nrows = 0
+
+    def __call__(self, chunk):
+        dims = dict()
+        for field, col in zip(chunk._fields, chunk):
+            dims.update(zip(self.layout.shapes.get(field, ()), np.shape(col)[1:]))
+
+        if self.dims is None:
+            self.dims = dims
+        elif dims != self.dims:
+            for d in self.layout.dims:
+                if dims[d] != self.dims[d]:
+                    raise ValueError(f"{d} changed from {self.dims[d]} to {dims[d]}")
+
+        for f, col, dt in zip(self.columns, chunk, self.layout.dtypes):
+            f.write(np.ascontiguousarray(col, dtype=dt).tobytes())
+        self.nrows += chunk.nrows
+
+    def close(self):
+        layout = self.layout
+        dims = self.dims if self.dims is not None else dict.fromkeys(layout.dims, 0)
+
+        offsets = list()
+        pos = layout.header_size
+        for field, dt in zip(layout.chunk_type._fields, layout.dtypes):
+            pos = -(-pos // layout.align) * layout.align
+            offsets.append(pos)
+            pos += self.nrows * int(np.prod(layout.row_shape(field, dims))) * dt.itemsize
+
+        header = layout.header.pack(layout.magic, layout.version,
+                                    *(dims[d] for d in layout.dims), self.nrows, *offsets)
+        with open(self.filename, "wb") as out:
+            out.write(header.ljust(layout.header_size, b"\0"))
+            for f, offset in zip(self.columns, offsets):
+                out.write(b"\0" * (offset - out.tell()))
+                f.seek(0)
+                shutil.copyfileobj(f, out)
+                f.close()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+#
+# Columnar storage of TRD digits
+
+import numpy as np
+from typing import NamedTuple
+
+from .columns import ColumnSink, ColumnFile, ColumnFileWriter
+
+
+class digits_t(NamedTuple):
+    """A chunk of digits, stored as one NumPy array per column"""
+    event: np.ndarray
+    det: np.ndarray
+    rob: np.ndarray
+    mcm: np.ndarray
+    channel: np.ndarray
+    adc: np.ndarray # shape (ndigits, ntb)
+
+    @property
+    def nrows(self):
+        return len(self.event)
+
+
+# data types of the columns of digits_t
+digit_dtypes = digits_t(
+    event = np.dtype("<u4"),
+    det = np.dtype("<u2"),
+    rob = np.dtype("u1"),
+    mcm = np.dtype("u1"),
+    channel = np.dtype("u1"),
+    adc = np.dtype("<u2"))
+
+
+class DigitSink(ColumnSink):
+    """Collect digits in growable NumPy columns and hand them out in chunks
+
+    An instance can be passed as `store_digits` to the TRD parser. The
+    parser then hands over the ADC data of a whole MCM in a single call of
+    store_mcm(). Calling the instance with the arguments of a single digit
+    is supported for compatibility.
+
+    The callback is called with a digits_t whenever a chunk is complete
+    (see ColumnSink). All digits in a chunk have the same number of time
+    bins."""
+
+    def __init__(self, callback, chunk_size=None, capacity=1024):
+        super().__init__(digits_t, digit_dtypes, callback, chunk_size,
+                         capacity if chunk_size is None else chunk_size+21)
+
+    def __call__(self, event, det, rob, mcm, channel, adcdata):
+        self.store_mcm(event, det, rob, mcm, (channel,), adcdata[np.newaxis])
+
+    def store_mcm(self, event, det, rob, mcm, channels, adc):
+        """Store the digits of several channels of one MCM
+
+        adc is an array of shape (len(channels), ntb)."""
+
+        self.append(len(channels), event, det, rob, mcm, channels, adc)
+
+
+# Binary digits files
+#
+# The header holds the number of time bins, ADC values are stored as
+# uint16 with shape (ndigits, ntb).
+
+digit_file = ColumnFile(digits_t, digit_dtypes, b"TRDDIGIT",
+                        shapes=dict(adc=("ntb",)), name="digits")
+
+
+class DigitFileWriter(ColumnFileWriter):
+    """Write chunks of digits (see DigitSink) to a binary digits file
+
+    All digits in a file must have the same number of time bins."""
+
+    def __init__(self, filename="digits.bin"):
+        super().__init__(digit_file, filename)
+
+
+def read_digits(filename):
+    """Map a binary digits file into memory
+
+    Returns a digits_t whose columns are read-only NumPy views of the file."""
+
+    return digit_file.read(filename)
@@ -19,7 +19,20 @@ from .rawlogging import StdoutHandler, HexDump
 @click.option('-q', '--quiet', count=True)
 @click.option('-k', '--skip-events', default=0)
 @click.option('-t', '--tracklet-format', default="auto")
-def evdump(source, loglevel, suppress, quiet, skip_events, tracklet_format):
+@click.option('-j', '--jobs', default=1,
+              help="number of worker processes; for ZeroMQ sources with a queue, "
+                   "decoder threads (no parallel decoding, events out of order)")
+@click.option('-e', '--event', 'events', type=int, multiple=True,
+              help="decode only the given event number(s)")
+@click.option('--mmap', 'use_mmap', is_flag=True,
+              help="map input files into memory instead of reading them")
+@click.option('--cache/--no-cache', default=True,
+              help="convert o32 files to a binary cache ($PYTRD_CACHE_DIR)")
+@click.option('--queue-size', default=0,
+              help="receive ZeroMQ messages into a queue of this size")
+@click.option('--policy', type=click.Choice(["block", "drop-oldest", "sample"]),
+              default="block", help="what to do with messages if the queue is full")
+def evdump(source, loglevel, suppress, quiet, skip_events, tracklet_format, jobs, events, use_mmap, cache, queue_size, policy):
 
     # Configure logging with a handler that works better with less
     # This handler terminates the programme when a pipe into less terminates.
@@ -34,7 +47,8 @@ def evdump(source, loglevel, suppress, quiet, skip_events, tracklet_format):
 
 
     # We leave the rest to the reader
-    reader = make_reader(source)
+    reader = make_reader(source, use_mmap=use_mmap, cache=cache,
+                         queue_size=queue_size, policy=policy)
     reader.add_trd_parser(tracklet_format=tracklet_format)
-    reader.process(skip_events=skip_events)
+    reader.process(skip_events=skip_events, jobs=jobs, events=events or None)
 
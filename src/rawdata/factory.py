@@ -1,28 +1,40 @@
 
+import logging
+
 from .o32reader import o32reader
+from .o32cache import O32Cache, O32CacheReader
 from .tfreader import TimeFrameReader, RdhStreamParser
 from .zmqreader import zmqreader
 from .minidaqreader import MiniDaqReader
 
 
-def make_reader(source):
+logger = logging.getLogger(__name__)
+
+
+def make_reader(source, use_mmap=False, cache=True, queue_size=0, policy="block"):
 
     # Instantiate the reader that will get events and subevents from the source
     if source.endswith(".o32") or source.endswith(".o32.bz2"):
+        # o32 files are converted once to the binary MiniDAQ format
+        if cache:
+            try:
+                return O32CacheReader(O32Cache().get(source), use_mmap=True)
+            except (OSError, ValueError) as e:
+                logger.warning(f"cannot use cache for {source}: {e}")
+
         return o32reader(source)
 
-    # TODO: timeframe readers temporarily disabled
     elif source.endswith(".tf") or source.endswith(".lnk"):
-        return TimeFrameReader(source)
+        return TimeFrameReader(source, use_mmap=use_mmap)
         # reader.log_header = lambda x: x.hexdump()
 
     elif source.endswith('.bin'):
-        return MiniDaqReader(source)
+        return MiniDaqReader(source, use_mmap=use_mmap)
         # reader.hexdump = hdump
         # reader.parsers[0x10] = trdfeeparser
 
-    # elif source.startswith('tcp://'):
-    #     reader = zmqreader(source)
+    elif source.startswith('tcp://'):
+        return zmqreader(source, queue_size=queue_size, policy=policy)
 
     else:
         raise ValueError(f"unknown source type: {source}")
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+#
+# Mapping of the TRD readout electronics to pad coordinates
+#
+# A readout board (ROB) carries 16 MCMs in a 4x4 grid, every MCM reads out
+# 21 ADC channels. The ROBs of a chamber are arranged in two columns, ROBs
+# with even numbers on the A side and odd numbers on the B side. The
+# formulas follow FeeParam::getPadRowFromMCM/getPadColFromADC in O2.
+
+import numpy as np
+
+nrob = 8         # ROBs per chamber (6 in stack 2)
+nmcm = 16        # MCMs per ROB
+nadc = 21        # ADC channels per MCM
+nmcmrobincol = 4 # MCMs per ROB in a column
+ncolmcm = 18     # pad columns per MCM
+ncolumn = 144    # pad columns per chamber
+
+
+def _make_table():
+    rob, mcm, channel = np.meshgrid(np.arange(nrob), np.arange(nmcm),
+                                    np.arange(nadc), indexing="ij")
+
+    padrow = 4*(rob//2) + mcm//nmcmrobincol
+
+    mcmcol = mcm % nmcmrobincol + (rob % 2) * nmcmrobincol
+    padcol = mcmcol*ncolmcm + ncolmcm + 1 - channel
+
+    # shared channels at the chamber edges are not connected to a pad
+    padcol[(padcol < 0) | (padcol >= ncolumn)] = -1
+
+    return np.stack((padrow, padcol), axis=-1).astype(np.int16)
+
+
+# lookup table of (padrow, padcol), indexed by [rob, mcm, channel]
+pad_table = _make_table()
+pad_table.flags.writeable = False
+padrow_table = pad_table[..., 0]
+padcol_table = pad_table[..., 1]
+
+
+def pad_coordinates(rob, mcm, channel):
+    """Map arrays of rob, mcm and channel numbers to pad rows and columns
+
+    Channels that are not connected to a pad of the chamber get column -1.
+    Returns a tuple (padrow, padcol) of int16 arrays."""
+
+    pads = pad_table[rob, mcm, channel]
+    return pads[..., 0], pads[..., 1]
@@ -5,48 +5,66 @@ import sys
 import zmq
 import numpy as np
 import argparse
-from struct import unpack
+from struct import unpack_from
 import time
 import logging
 
+logger = logging.getLogger(__name__)
+
 
 class TrdboxHeader:
+    """Header of a message from the TRDbox publisher
 
-    def __init__(self, data):
+    The header is parsed from a bytes object or a memoryview (e.g. the
+    buffer of a zmq.Frame) without copying the message. Log messages are
+    only generated by hexdump()."""
 
-        # ( self.magic, self.equipment_type, self.equipment_id, self.version,
-        # self.header_size, self.payload_size )
+    def __init__(self, data):
 
         # parse the first 3 data words
-        (magic, ety,eid,ver, hsz,psz)= unpack("IBBxBxBH",data[0:12])
-
-        # get the dwords of the header
-        dw = np.frombuffer(data[:hsz], dtype=np.uint32)
+        (magic, ety,eid,ver, pszhi,hsz,psz)= unpack_from("<IBBxBBBH",data,0)
 
-        if magic == 0xDA7AFEED:
-            logging.info(f"hdr00  {dw[0]:08x}  magic token")
-        else:
-            logging.error(f"hdr00  {dw[0]:08x}  unknown magic token")
+        if magic != 0xDA7AFEED:
+            logger.error(f"hdr00  {magic:08x}  unknown magic token")
             raise AssertionError('invalid magic token')
 
-        logging.info(f"hdr00  {dw[1]:08x}  equipment {ety:02X}:{eid:02X} header version v{ver}")
-        logging.info(f"hdr00  {dw[2]:08x}  hdr:{hsz}b  payload: {psz}=0x{psz:04X}b 0x{psz//4:X} dwords")
-
+        self._data = data
+        self.magic = magic
         self.equipment_type = ety
         self.equipment_id = eid
+        self.version = ver
         self.header_size = hsz
         self.payload_size = psz
 
+        # version 2 headers extend the payload size to 24 bits
+        if ver == 2:
+            self.payload_size |= pszhi << 16
+
         # parse the time information
-        if ver in [1]:
-            ( sec, ns ) = unpack("II",data[12:20])
-            self.timestamp = float(sec) + float(ns)*1e-9
+        self.sec, self.nanosec = 0, 0
+        self.timestamp = None
+        if ver in [1, 2]:
+            ( self.sec, self.nanosec ) = unpack_from("<II",data,12)
+            self.timestamp = float(self.sec) + float(self.nanosec)*1e-9
+
+    def hexdump(self):
+        """Log the header dwords, if INFO messages are enabled"""
 
-        logging.info(f"hdr00  {dw[3]:08x}  {time.ctime(self.timestamp)}")
-        # logging.info(f"hdr00  {dw[3]:08x}  {time.ctime(time.gmtime(sec))}")
-        logging.info(f"hdr00  {dw[4]:08x}  {ns}")
+        if not logger.isEnabledFor(logging.INFO):
+            return
+
+        # get the dwords of the header
+        dw = np.frombuffer(self._data, dtype=np.uint32, count=self.header_size//4)
 
+        ety, eid = self.equipment_type, self.equipment_id
+        hsz, psz = self.header_size, self.payload_size
+        logger.info(f"hdr00  {dw[0]:08x}  magic token")
+        logger.info(f"hdr00  {dw[1]:08x}  equipment {ety:02X}:{eid:02X} header version v{self.version}")
+        logger.info(f"hdr00  {dw[2]:08x}  hdr:{hsz}b  payload: {psz}=0x{psz:04X}b 0x{psz//4:X} dwords")
 
+        if self.timestamp is not None:
+            logger.info(f"hdr00  {dw[3]:08x}  {time.ctime(self.timestamp)}")
+            logger.info(f"hdr00  {dw[4]:08x}  {self.nanosec}")
 
 
     # def __str__(self):
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+#
+# Cached indices of raw data files
+#
+# An index is a set of NumPy arrays, saved as an uncompressed .npz file in
+# the index directory of the cache ($PYTRD_CACHE_DIR/index, by default
+# ~/.cache/pytrd/index), so reading a file never writes next to it. Index
+# files are named after a hash of the absolute path of the data file. They
+# store the size and modification time of the data file, and are only used
+# as long as they are unchanged.
+
+import hashlib
+import os
+import numpy as np
+
+
+def cache_directory():
+    """The directory for cached files, from $PYTRD_CACHE_DIR"""
+    return os.environ.get("PYTRD_CACHE_DIR",
+        os.path.join(os.path.expanduser("~"), ".cache", "pytrd"))
+
+
+def index_path(filename, suffix):
+    """Location of the index of the data file `filename`"""
+    digest = hashlib.sha1(os.path.abspath(filename).encode()).hexdigest()
+    return os.path.join(cache_directory(), "index", digest + suffix)
+
+
+def _signature(filename):
+    st = os.stat(filename)
+    return np.array([st.st_size, st.st_mtime_ns], dtype=np.int64)
+
+
+def save_index(filename, suffix, **arrays):
+    """Save the index arrays of the data file `filename`"""
+
+    target = index_path(filename, suffix)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    # write to a temporary file first, so that readers never see a
+    # partially written index
+    tmpname = f"{target}.{os.getpid()}"
+    with open(tmpname, "wb") as f:
+        np.savez(f, signature=_signature(filename), **arrays)
+    os.replace(tmpname, target)
+
+
+def load_index(filename, suffix):
+    """Load the index arrays of the data file `filename`
+
+    Returns a dict of arrays, or None if there is no index or if it is
+    outdated."""
+
+    try:
+        with np.load(index_path(filename, suffix)) as idx:
+            if not np.array_equal(idx['signature'], _signature(filename)):
+                return None
+            return {k: idx[k] for k in idx.files if k != 'signature'}
+    except (OSError, KeyError, ValueError):
+        return None
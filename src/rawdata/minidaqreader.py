@@ -2,12 +2,17 @@
 #
 
 import logging
+import mmap
 import time
+import numpy as np
 
 from .rawlogging import AddLocationFilter, HexDump
 from .base import BaseHeader
 from .bitstruct import BitStruct
 from .trdfeeparser import make_trd_parser
+from .parallel import process_parallel
+from .index import save_index, load_index
+from .constants import magicmarker
 import struct
 
 logger = logging.getLogger(__name__)
@@ -21,15 +26,27 @@ logger.addFilter(logflt)
     sec=32, nanosec=32) # word3, word4
 class MiniDaqHeader(BaseHeader):
 
-    def __init__(self, data, addr):
+    __slots__ = ()
 
-        super().__init__(data,addr)
+    # Version 2 headers are written for payloads of more than 64 kB, e.g.
+    # by the o32 cache. They are identical to version 1, except that the
+    # reserved byte before hdrsize holds bits 16-23 of the payload size.
+    @property
+    def payload_size(self):
+        if self.version == 2:
+            return self.res1 << 16 | self.datasize
+        return self.datasize
 
-        # parse the time information
-        if self.version in [1]:
-            # ( sec, ns ) = unpack("II",data[12:20])
-            self.timestamp = float(self.sec) + float(self.nanosec)*1e-9
-            self.time = time.ctime(self.timestamp)
+    # the time information is only available in version 1 and 2 headers
+    @property
+    def timestamp(self):
+        if self.version not in [1, 2]:
+            raise AttributeError(f"no time stamp in MiniDAQ header v{self.version}")
+        return float(self.sec) + float(self.nanosec)*1e-9
+
+    @property
+    def time(self):
+        return time.ctime(self.timestamp)
 
     def equipment(self):
         return self.equipment_type<<8 | self.equipment_id
@@ -37,24 +54,137 @@ class MiniDaqHeader(BaseHeader):
     # hexdump formatting info
 
     def hexdump(self):
+        """Log the header dwords, if INFO messages are enabled"""
+
         hexlogger = logger.getChild(f"hexdump.minidaq")
+        if not hexlogger.isEnabledFor(logging.INFO):
+            return
 
         txt = list((
             f"MiniDAQ magic word 0x{self.magic:08x}",
             f"equipment {self.equipment_type:02X}:{self.equipment_id:02X} header version v{self.version}",
-            f"hdr:{self.hdrsize} bytes  payload: {self.datasize}=0x{self.datasize:04X} bytes",
-            f"{self.time}", ""))
+            f"hdr:{self.hdrsize} bytes  payload: {self.payload_size}=0x{self.payload_size:04X} bytes",
+            f"{self.time}" if self.version in [1, 2] else "", ""))
 
         for i, words in enumerate(struct.iter_unpack("<I", self._data)):
             extra = dict(hexaddr=self._addr+4*i, hexdata=words[0])
-            hexlogger.getChild(f"MQ{i}").info(txt, extra=extra)
+            hexlogger.getChild(f"MQ{i}").info(txt[i], extra=extra)
+
+def minidaq_header(equipment_type, equipment_id, datasize, sec=0, nanosec=0):
+    """Build the 20-byte header of a MiniDAQ event or subevent
+
+    Payloads of more than 64 kB get a version 2 header (see MiniDaqHeader),
+    the limit is 16 MB."""
+
+    if datasize > 0xFFFFFF:
+        raise ValueError(f"payload of {datasize} bytes too large for MiniDAQ header")
+
+    version = 1 if datasize <= 0xFFFF else 2
+    return struct.pack("<LBBBBBBHLL", magicmarker, equipment_type, equipment_id,
+                       0, version, datasize >> 16, MiniDaqHeader.header_size,
+                       datasize & 0xFFFF, sec, nanosec)
+
+
+class MiniDaqIndex:
+    """Index of the events in a MiniDAQ file
+
+    For every event, the index holds the byte offset and size, the time
+    stamp (NaN if unknown) and the equipments of its subevents. The
+    equipments of event i are equipment[eqstart[i]:eqstart[i+1]], encoded
+    as equipment_type<<8 | equipment_id.
+
+    The index is saved in the cache (see index.py) and reused as long as
+    the size and modification time of the data file are unchanged."""
+
+    suffix = ".idx"
+
+    def __init__(self, offset, size, timestamp, eqstart, equipment):
+        self.offset = offset
+        self.size = size
+        self.timestamp = timestamp
+        self.eqstart = eqstart
+        self.equipment = equipment
+
+    def __len__(self):
+        return len(self.offset)
+
+    def equipments(self, evno):
+        return self.equipment[self.eqstart[evno]:self.eqstart[evno+1]]
+
+    @classmethod
+    def scan(cls, read, filesize):
+        """Build the index from the MiniDAQ headers, skipping all payloads
+
+        read(addr, size) has to return the data at the given byte range of
+        the file, see MiniDaqReader.read()."""
+
+        offset, size, timestamp = list(), list(), list()
+        eqstart, equipment = [0], list()
+
+        addr = 0
+        while addr < filesize:
+            data = read(addr, MiniDaqHeader.header_size)
+            if len(data) != MiniDaqHeader.header_size:
+                logger.info(f"read {len(data)} bytes at offset {addr}")
+                break
+
+            hdr = MiniDaqHeader(data, addr)
+            offset.append(addr)
+            size.append(hdr.header_size + hdr.payload_size)
+            timestamp.append(getattr(hdr, 'timestamp', np.nan))
+
+            if hdr.equipment_type == 1:
+                # an event: collect the equipments of its subevents
+                pos = addr + hdr.header_size
+                end = pos + hdr.payload_size
+                while pos + MiniDaqHeader.header_size <= end:
+                    data = read(pos, MiniDaqHeader.header_size)
+                    if len(data) != MiniDaqHeader.header_size:
+                        break
+                    sub = MiniDaqHeader(data, pos)
+                    equipment.append(sub.equipment())
+                    pos += sub.header_size + sub.payload_size
+            else:
+                equipment.append(hdr.equipment())
+
+            eqstart.append(len(equipment))
+            addr += size[-1]
+
+        return cls(np.array(offset, dtype=np.uint64),
+                   np.array(size, dtype=np.uint32),
+                   np.array(timestamp, dtype=np.float64),
+                   np.array(eqstart, dtype=np.uint32),
+                   np.array(equipment, dtype=np.uint16))
+
+    def save(self, filename):
+        """Save the index of the data file `filename`"""
+        save_index(filename, self.suffix, offset=self.offset, size=self.size,
+                   timestamp=self.timestamp, eqstart=self.eqstart,
+                   equipment=self.equipment)
+
+    @classmethod
+    def load(cls, filename):
+        """Load the index of the data file `filename`
+
+        Returns None if there is no index or if it is outdated."""
+
+        idx = load_index(filename, cls.suffix)
+        if idx is None:
+            return None
+        return cls(**idx)
+
 
 class MiniDaqReader:
     """Reader class for MiniDAQ files 
 
-    The class can be used as an iterator over events in the file."""
+    The class can be used as an iterator over events in the file.
+
+    With use_mmap=True, the file is mapped into memory. Headers and
+    payloads are then parsed from slices of the mapped file, without
+    copying them."""
 
-    def __init__(self, filename):
+    def __init__(self, filename, use_mmap=False):
+        self.filename = filename
         self.file = open(filename,"rb")
         
         # find filesize
@@ -62,42 +192,114 @@ class MiniDaqReader:
         self.filesize =self.file.tell()
         self.file.seek(0)
 
+        # empty files cannot be mapped
+        self.options = dict(use_mmap=use_mmap)
+        self.buffer = None
+        if use_mmap and self.filesize > 0:
+            self.buffer = memoryview(mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ))
+
         self.parsers = dict()
+        self.trd_parser_kwargs = dict()
         self.hexdump = lambda x: None # Default: no logging
-        self.event = 0
+        self._index = None
+
+    @property
+    def index(self):
+        """The event index of the file, built on first use"""
+
+        if self._index is None:
+            self._index = MiniDaqIndex.load(self.filename)
+
+        if self._index is None:
+            self._index = MiniDaqIndex.scan(self.read, self.filesize)
+            try:
+                self._index.save(self.filename)
+            except OSError as e:
+                logger.warning(f"cannot save event index: {e}")
+
+        return self._index
+
+    def read(self, addr, size):
+        """Return `size` bytes at offset `addr` of the file
+
+        In mmap mode, the data is a memoryview of the mapped file."""
+
+        if self.buffer is not None:
+            return self.buffer[addr:addr+size]
+
+        self.file.seek(addr)
+        return self.file.read(size)
 
     def add_trd_parser(self, **kwargs):
+        self.trd_parser_kwargs = kwargs
         self.parsers[0x10] = make_trd_parser(has_cruheader=False, **kwargs)
 
-    def process(self, skip_events=0):
-        """Read entire file."""
-        while self.file.tell() < self.filesize:
-            self.read()
+    def process(self, skip_events=0, jobs=1, events=None):
+        """Read entire file.
 
-    def read(self):
-        addr = self.file.tell()
-        data = self.file.read(20)
-        if len(data)!=20:
-            logger.info(f"read {len(data)} bytes at offset {addr}")
-            return
+        The events to decode are looked up in the event index, so skipped
+        events are not read at all. `events` selects individual events by
+        number. With jobs > 1, the events are decoded in a pool of worker
+        processes."""
+
+        if events is None:
+            events = range(skip_events, len(self.index))
+
+        if jobs > 1:
+            return process_parallel(self, jobs, tasks=self.split_events(events))
+
+        for task in self.split_events(events):
+            self.decode_event(*task)
+
+    def split_events(self, events=None):
+        """Find the byte ranges of events in the file
+
+        Each header at the top level of the file (usually an event header
+        with equipment type 1, followed by its subevents) starts a new
+        event. The byte ranges are taken from the event index. The method
+        yields tuples (evno, addr, size) for all events, or the event
+        numbers in `events`, that can be passed to decode_event()."""
+
+        index = self.index
+        if events is None:
+            events = range(len(index))
+
+        for evno in events:
+            if evno >= len(index):
+                logger.error(f"event {evno} not found, file has {len(index)} events")
+                continue
+            yield (evno, int(index.offset[evno]), int(index.size[evno]))
 
-        hdr = MiniDaqHeader(data, addr)
-        # self.hexdump(hdr)
-        hdr.hexdump()
+    def decode_event(self, evno, addr, size):
+        """Read and decode the event at the given byte range"""
+        self.process_event(evno, self.read(addr, size), addr)
 
-        if hdr.equipment_type == 1:
-            # eq. type 1 is a MiniDaq event, which contains subevents 
-            self.read()
-        elif hdr.equipment_type in self.parsers:
-            # self.parsers[hdr.equipment_type].reset()
-            self.parsers[hdr.equipment_type].parse(self.file, hdr.datasize)
-        else:
-            self.file.seek(hdr.datasize, 1)  # skip over payload
+    def process_event(self, evno, data, addr):
+        """Decode one event and its subevents from a buffer"""
 
-        self.event += 1
-        logger.warning(f"Processed {self.event} events")
+        for parser in self.parsers.values():
+            parser.set_event(evno)
 
+        payload = memoryview(data)
+        pos = 0
+        while pos < len(data):
+            if len(data) - pos < MiniDaqHeader.header_size:
+                logger.info(f"read {len(data)-pos} bytes at offset {addr+pos}")
+                break
 
+            hdr = MiniDaqHeader(payload[pos:pos+MiniDaqHeader.header_size], addr+pos)
+            # self.hexdump(hdr)
+            hdr.hexdump()
+            pos += hdr.header_size
 
+            if hdr.equipment_type == 1:
+                # eq. type 1 is a MiniDaq event, which contains subevents 
+                continue
+            elif hdr.equipment_type in self.parsers:
+                self.parsers[hdr.equipment_type].parse_buffer(
+                    payload[pos:pos+hdr.payload_size], addr+pos)
 
+            pos += hdr.payload_size  # skip over payload
 
+        logger.warning(f"Processed {evno+1} events")
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+#
+# Cache of o32 files converted to the binary MiniDAQ format
+#
+# Parsing the text of o32 files (and decompressing .o32.bz2) is slow. The
+# first time a file is read, it is converted to a MiniDAQ file with an
+# event header (equipment type 1) and one subevent (equipment type 0x10,
+# id = sfp) per data block. Later runs read the converted file instead.
+#
+# The cache directory is taken from $PYTRD_CACHE_DIR, or defaults to
+# ~/.cache/pytrd. Its size is limited to $PYTRD_CACHE_SIZE (in GB, default
+# 10); the least recently used files are removed first. If a file cannot be
+# converted, this is remembered in a small .failed file, so the conversion
+# is not attempted again for the same file.
+
+import hashlib
+import logging
+import os
+import time
+from datetime import timezone
+
+from .index import cache_directory, index_path
+from .o32reader import o32reader
+from .minidaqreader import minidaq_header, MiniDaqIndex, MiniDaqReader
+
+logger = logging.getLogger(__name__)
+
+
+def convert_o32(source, target):
+    """Convert an o32 file to a MiniDAQ file
+
+    Events of more than 64 kB get version 2 headers with a 24-bit payload
+    size. Raises ValueError if an event is larger than 16 MB."""
+
+    reader = o32reader(source)
+    with open(target, "wb") as out:
+        for evno, line_number, text in reader.split_events():
+            header, subevents = reader.read_event(line_number, text)
+
+            ts = header['time stamp'].replace(tzinfo=timezone.utc)
+            sec, nanosec = int(ts.timestamp()), 1000*ts.microsecond
+
+            body = b"".join(
+                minidaq_header(sub.equipment_type, sub.equipment_id,
+                               sub.size, sec, nanosec) + sub.payload.tobytes()
+                for sub in subevents)
+
+            out.write(minidaq_header(1, 0, len(body), sec, nanosec))
+            out.write(body)
+
+
+class O32CacheReader(MiniDaqReader):
+    """MiniDaqReader for a converted o32 file
+
+    Like o32reader, it uses the Run 2 tracklet format by default."""
+
+    def add_trd_parser(self, **kwargs):
+        if 'tracklet_format' not in kwargs:
+            kwargs['tracklet_format'] = 'run2'
+        super().add_trd_parser(**kwargs)
+
+
+class O32Cache:
+    """Directory with converted o32 files
+
+    Files are identified by a hash of the absolute path, size and
+    modification time of the o32 file, so changed files are converted
+    again."""
+
+    def __init__(self, directory=None, max_size=None):
+        if directory is None:
+            directory = cache_directory()
+
+        if max_size is None:
+            max_size = int(float(os.environ.get("PYTRD_CACHE_SIZE", 10)) * 1e9)
+
+        self.directory = directory
+        self.max_size = max_size
+
+    def path(self, source):
+        """Location of the converted file in the cache"""
+
+        st = os.stat(source)
+        key = f"{os.path.abspath(source)}:{st.st_size}:{st.st_mtime_ns}"
+        digest = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, digest + ".bin")
+
+    def get(self, source):
+        """Return the converted file for an o32 file, converting it if needed"""
+
+        target = self.path(source)
+        failed = target + ".failed"
+        if os.path.exists(failed):
+            raise ValueError(f"{source} could not be converted before, see {failed}")
+
+        if os.path.exists(target):
+            # remember the access for the LRU eviction - the modification
+            # time must not change, it validates the event index
+            os.utime(target, ns=(int(time.time()*1e9), os.stat(target).st_mtime_ns))
+            return target
+
+        logger.info(f"converting {source} to {target}")
+        os.makedirs(self.directory, exist_ok=True)
+        tmpname = f"{target}.{os.getpid()}"
+        try:
+            convert_o32(source, tmpname)
+            os.replace(tmpname, target)
+        except ValueError as e:
+            with open(failed, "w") as f:
+                f.write(f"{e}\n")
+            raise
+        finally:
+            if os.path.exists(tmpname):
+                os.remove(tmpname)
+
+        self.evict(keep=target)
+        return target
+
+    def evict(self, keep=None):
+        """Remove the least recently used files until the size limit is met"""
+
+        files = list()
+        for name in os.listdir(self.directory):
+            if name.endswith(".bin"):
+                path = os.path.join(self.directory, name)
+                st = os.stat(path)
+                files.append((st.st_atime, st.st_size, path))
+
+        total = sum(f[1] for f in files)
+        for atime, size, path in sorted(files):
+            if total <= self.max_size:
+                break
+            if path == keep:
+                continue
+
+            logger.info(f"removing {path} from cache")
+            os.remove(path)
+            index = index_path(path, MiniDaqIndex.suffix)
+            if os.path.exists(index):
+                os.remove(index)
+            total -= size
@@ -1,13 +1,14 @@
 
 import io
-import struct
 import re
-import subprocess
 from datetime import datetime
 from typing import NamedTuple
 import logging
+import numpy as np
 
 from .trdfeeparser import make_trd_parser
+from .parallel import process_parallel
+from .bz2stream import open_bz2
 
 logger = logging.getLogger("rawlog.o32")
 
@@ -20,18 +21,56 @@ class subevent_t(NamedTuple):
     equipment_type: int
     equipment_id: int
     # payload: Iterable[int]
-    # payload: numpy.ndarray
-    payload: io.BytesIO
+    payload: np.ndarray # uint32 data words
     size: int
 
 
+# value of hexadecimal digits, 0xFF for all other characters
+_hexvalue = np.full(256, 0xFF, dtype=np.uint8)
+for i, c in enumerate(b"0123456789abcdef"):
+    _hexvalue[c] = i
+for i, c in enumerate(b"ABCDEF"):
+    _hexvalue[c] = 10 + i
+
+
+def parse_hex_block(text, nlines):
+    """Convert a block of lines with one hexadecimal number each to uint32
+
+    The lines must have the same width and the form used in o32 files:
+    `0x` followed by up to 8 hex digits. They are converted in a few
+    vectorized operations. Returns None if the block has a different form."""
+
+    raw = np.frombuffer(text.encode("ascii", errors="replace"), dtype=np.uint8)
+    if nlines == 0 or len(raw) % nlines != 0:
+        return None
+
+    lines = raw.reshape(nlines, -1)
+    if not 4 <= lines.shape[1] <= 11:
+        return None
+
+    if not ((lines[:, 0] == ord("0")).all()
+            and ((lines[:, 1] | 0x20) == ord("x")).all()
+            and (lines[:, -1] == ord("\n")).all()):
+        return None
+
+    digits = _hexvalue[lines[:, 2:-1]]
+    if (digits == 0xFF).any():
+        return None
+
+    words = np.zeros(nlines, dtype=np.uint32)
+    for column in digits.T:
+        words <<= 4
+        words |= column
+    return words
+
+
 class o32reader:
     """Reader class for files in the .o32 format.
 
     The constructor takes a file name as input. If the if filename ends in
     '.o32' it is read as a normal text file. If it ends in '.o32.bz2' it is
-    assumed to be bzip2-compressed, and it is decompressed with bzcat before
-    parsing.
+    assumed to be bzip2-compressed, and it is decompressed in several threads
+    while parsing.
 
     The class can be used as an iterator over events in the file.
 
@@ -49,45 +88,97 @@ class o32reader:
         self.filename = file_name
         self.line_number=0
         self.linebuf = None
+        self.infile = None # text of the event that is being decoded
         self.parsers = dict()
+        self.trd_parser_kwargs = dict()
+
+        if not self.filename.endswith(('.o32', '.o32.bz2')):
+            raise ValueError(f"invalid file extension of input file {self.filename}")
+
+    def open(self):
+        """Open the input file and return it as a stream of lines"""
 
         if self.filename.endswith('.o32'):
-            self.infile=open(self.filename, 'r')
+            return open(self.filename, 'r')
 
         elif self.filename.endswith('.o32.bz2'):
-            self.proc = subprocess.Popen(["bzcat", self.filename],
-            stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-            self.infile = self.proc.stdout
-
-        else:
-            raise ValueError(f"invalid file extension of input file {self.filename}")
+            return open_bz2(self.filename)
 
     def add_trd_parser(self, **kwargs):
         if 'tracklet_format' not in kwargs:
             kwargs['tracklet_format'] = 'run2'
+        self.trd_parser_kwargs = kwargs
         self.parsers[0x10] = make_trd_parser(has_cruheader=False, **kwargs)
 
-    def process(self, skip_events=0):
+    def process(self, skip_events=0, jobs=1, events=None):
         """This method will handle the reading process.
         
-        It is meant as a replacement for the lecacy iterator interface."""
+        It is meant as a replacement for the lecacy iterator interface.
+        `events` selects individual events by number. With jobs > 1, the
+        events are decoded in a pool of worker processes."""
+
+        tasks = self.split_events()
+        if events is not None:
+            events = set(events)
+            tasks = (t for t in tasks if t[0] in events)
 
-        evno = -1
-        while True:
-            evno += 1
-            header = self.read_event_header()
+        if jobs > 1:
+            return process_parallel(self, jobs, skip_events, tasks=tasks)
 
-            for i in range(header['data blocks']):
-                subevent = self.read_subevent()
+        for task in tasks:
+            if task[0] >= skip_events:
+                self.decode_event(*task)
 
-                if evno < skip_events:
-                    continue
+    def split_events(self):
+        """Split the input file into the text of individual events
 
-                if subevent.equipment_type in self.parsers:
-                    self.parsers[subevent.equipment_type].parse(
-                        subevent.payload, subevent.size)
+        The events are found from the `# EVENT` markers. The method yields
+        tuples (evno, line_number, text) with the number of the first line
+        of each event, which can be passed to decode_event()."""
 
-            logger.warning(f"Processed {evno+1} events")
+        evno = 0
+        first_line = 1
+        lines = list()
+        for line in self.open():
+
+            if line.rstrip() == '# EVENT' and len(lines) > 0:
+                yield (evno, first_line, "".join(lines))
+                evno += 1
+                first_line += len(lines)
+                lines = list()
+
+            lines.append(line)
+
+        if len(lines) > 0:
+            yield (evno, first_line, "".join(lines))
+
+    def read_event(self, line_number, text):
+        """Read the header of one event from its text
+
+        Returns the header and an iterator that reads the subevents."""
+
+        self.infile = io.StringIO(text)
+        self.line_number = line_number - 1
+        self.linebuf = None
+
+        header = self.read_event_header()
+        subevents = (self.read_subevent() for i in range(header['data blocks']))
+        return header, subevents
+
+    def decode_event(self, evno, line_number, text):
+        """Decode one event from its text"""
+
+        for parser in self.parsers.values():
+            parser.set_event(evno)
+
+        header, subevents = self.read_event(line_number, text)
+
+        for subevent in subevents:
+            if subevent.equipment_type in self.parsers:
+                self.parsers[subevent.equipment_type].parse_buffer(
+                    subevent.payload)
+
+        logger.warning(f"Processed {evno+1} events")
 
 
     def read_event_header(self):
@@ -144,17 +235,26 @@ class o32reader:
         m = re.search('## *size: *(.*)', self.read_line())
         payload_size = int(m.group(1))
 
-        payload = bytes()
-        for i in range(payload_size):
-             dword = int(self.infile.readline().decode(), 0)
-             payload += struct.pack("<I",dword)
+        # All lines of the payload usually have the same width. The block
+        # is then read at once and converted in one go.
+        payload = None
+        if payload_size > 0:
+            start = self.infile.tell()
+            first = self.infile.readline()
+            block = first + self.infile.read(len(first) * (payload_size-1))
+            payload = parse_hex_block(block, payload_size)
+
+            if payload is None:
+                # convert the lines one by one
+                self.infile.seek(start)
+                payload = np.array([int(self.infile.readline(), 0)
+                                    for i in range(payload_size)], dtype=np.uint32)
+        else:
+            payload = np.empty(0, dtype=np.uint32)
+
         self.line_number += payload_size
-        
-        if 4*payload_size != len(payload):
-            logger.critical(
-                f"payload sizes do not match {4*payload_size} != {len(payload)}")
-            
-        return subevent_t(equipment_type, equipment_id, io.BytesIO(payload), len(payload))
+
+        return subevent_t(equipment_type, equipment_id, payload, payload.nbytes)
 
 
 
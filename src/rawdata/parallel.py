@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+#
+# Parallel decoding of events in a pool of worker processes
+#
+# The main process only splits the input into events (e.g. byte ranges of
+# MiniDAQ events, or the text of o32 events) and hands them to the workers.
+# Every worker owns a reader for the same source with its own TRD parser.
+# Digits and log messages produced by the workers are sent back and merged
+# in event order, so that the output is the same as for sequential decoding.
+# The same holds for tracklets.
+
+import logging
+import logging.handlers
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from .digits import DigitSink
+from .tracklets import TrackletSink
+
+logger = logging.getLogger(__name__)
+
+# state of a worker process, set up by _init_worker
+_reader = None
+_records = None
+_digits = None
+_sink = None
+_tracklets = None
+_tracklet_sink = None
+
+
+class _RecordBuffer(list):
+    """Minimal queue for a logging.handlers.QueueHandler"""
+
+    def put_nowait(self, record):
+        self.append(record)
+
+
+def _loglevels():
+    """Levels of all loggers that have been configured explicitly"""
+    levels = {"": logging.getLogger().level}
+    for name, lg in logging.root.manager.loggerDict.items():
+        if isinstance(lg, logging.Logger) and lg.level != logging.NOTSET:
+            levels[name] = lg.level
+    return levels
+
+
+def _init_worker(reader_class, source, reader_options, parser_kwargs, loglevels,
+                 digits, tracklets):
+    global _reader, _records, _digits, _sink, _tracklets, _tracklet_sink
+
+    # Capture all log records, they are passed on by the main process
+    _records = _RecordBuffer()
+    root = logging.getLogger()
+    for h in list(root.handlers):
+        root.removeHandler(h)
+    root.addHandler(logging.handlers.QueueHandler(_records))
+
+    for name, level in loglevels.items():
+        logging.getLogger(name).setLevel(level)
+
+    # digits are collected in one chunk per event
+    _digits = list()
+    _sink = DigitSink(_digits.append) if digits else None
+    _tracklets = list()
+    _tracklet_sink = TrackletSink(_tracklets.append) if tracklets else None
+    _reader = reader_class(source, **reader_options)
+    if parser_kwargs is not None:
+        _reader.add_trd_parser(store_digits=_sink,
+                               store_tracklets=_tracklet_sink, **parser_kwargs)
+
+
+def _decode_event(task):
+    del _records[:]
+    del _digits[:]
+    del _tracklets[:]
+    _reader.decode_event(*task)
+    if _sink is not None:
+        _sink.flush()
+    if _tracklet_sink is not None:
+        _tracklet_sink.flush()
+    return list(_records), list(_digits), list(_tracklets)
+
+
+def process_parallel(reader, jobs, skip_events=0, max_pending=None, tasks=None):
+    """Decode the events of a reader in a pool of worker processes
+
+    The reader has to provide split_events(), which yields picklable tasks
+    whose first element is the event number, and decode_event(*task) to
+    decode a single event. Workers construct their own reader from the
+    class, filename and `options` (if any) of `reader`.
+
+    Arguments:
+      reader      : reader whose events are decoded
+      jobs        : number of worker processes
+      skip_events : number of events at the start to skip
+      max_pending : maximum number of events in flight, default 4*jobs
+      tasks       : tasks to decode instead of reader.split_events()"""
+
+    if max_pending is None:
+        max_pending = 4*jobs
+
+    if tasks is None:
+        tasks = reader.split_events()
+
+    # digits and tracklets are stored by the main process, the workers
+    # only collect them
+    parser_kwargs = None
+    store_digits = None
+    store_tracklets = None
+    if len(reader.parsers) > 0:
+        parser_kwargs = dict(reader.trd_parser_kwargs)
+        store_digits = parser_kwargs.pop('store_digits', None)
+        store_tracklets = parser_kwargs.pop('store_tracklets', None)
+
+    initargs = (type(reader), reader.filename, getattr(reader, 'options', {}),
+                parser_kwargs, _loglevels(),
+                store_digits is not None, store_tracklets is not None)
+
+    def merge(result):
+        records, chunks, tracklet_chunks = result
+        for record in records:
+            logging.getLogger(record.name).handle(record)
+
+        for chunk in chunks:
+            if hasattr(store_digits, 'store_chunk'):
+                store_digits.store_chunk(chunk)
+            elif store_digits is not None:
+                for i in range(chunk.nrows):
+                    store_digits(*(int(c[i]) for c in chunk[:5]), chunk.adc[i])
+
+        for chunk in tracklet_chunks:
+            if hasattr(store_tracklets, 'store_chunk'):
+                store_tracklets.store_chunk(chunk)
+            else:
+                for i in range(chunk.nrows):
+                    store_tracklets(*(int(c[i]) for c in chunk))
+
+        return sum(chunk.nrows for chunk in chunks)
+
+    nevents = 0
+    ndigits = 0
+    pending = deque()
+    with ProcessPoolExecutor(jobs, initializer=_init_worker, initargs=initargs) as pool:
+        for task in tasks:
+            if task[0] < skip_events:
+                continue
+
+            pending.append(pool.submit(_decode_event, task))
+            if len(pending) >= max_pending:
+                ndigits += merge(pending.popleft().result())
+                nevents += 1
+
+        while len(pending) > 0:
+            ndigits += merge(pending.popleft().result())
+            nevents += 1
+
+    if store_digits is not None:
+        logger.info(f"Decoded {nevents} events with {ndigits} digits in {jobs} processes")
+    else:
+        logger.info(f"Decoded {nevents} events in {jobs} processes")
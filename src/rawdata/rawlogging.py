@@ -211,7 +211,7 @@ class HexDump:
 
         if len(args) == 1:
             # render all the descriptions
-            desc = list(d.format(**vars(args[0])) for d in args[0]._hexdump_desc)
+            desc = args[0].hexdump_desc()
 
             # ensure we have the same width for all fields
             maxlen = max(len(x) for x in desc)
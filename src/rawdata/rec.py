@@ -2,11 +2,15 @@
 
 import click
 import logging
+import numpy as np
 
 from .header import TrdboxHeader
 # from .trdfeeparser import TrdFeeParser, logflt
 from .factory import make_reader
 from .rawlogging import ColorFormatter
+from .digits import DigitSink, DigitFileWriter
+from .tracklets import TrackletSink, TrackletFileWriter
+from .geometry import pad_coordinates
 # from .o32reader import o32reader
 # from .zmqreader import zmqreader
 
@@ -20,22 +24,42 @@ class digits_csv_file:
             self.outfile.write(f",A{i:02}")
         self.outfile.write("\n")
 
-    def __call__(self,ev,det,rob,mcm,ch,digits):
-        # TODO: calculate pad row/column from rob/mcm/channel
-        padrow = -1
-        padcol = -1
+    def __call__(self, digits):
+        """Write a chunk of digits (see DigitSink) to the file"""
+
+        padrow, padcol = pad_coordinates(digits.rob, digits.mcm, digits.channel)
 
         # save output to file
-        self.outfile.write(f"{ev},{det},{rob},{mcm},{ch},{padrow},{padcol},")
-        self.outfile.write(",".join([str(x) for x in digits]))
-        self.outfile.write("\n")
+        table = np.column_stack((digits.event, digits.det, digits.rob,
+            digits.mcm, digits.channel, padrow, padcol, digits.adc))
+        np.savetxt(self.outfile, table, fmt="%d", delimiter=",")
+
+    def close(self):
+        self.outfile.close()
 
 @click.command()
 @click.argument('source', default='tcp://localhost:7776')
 @click.option('-o', '--loglevel', default=logging.INFO)
 @click.option('-k', '--skip-events', default=0)
 @click.option('-t', '--tracklet-format', default="auto")
-def rec_digits(source, loglevel, skip_events, tracklet_format):
+@click.option('-j', '--jobs', default=1,
+              help="number of worker processes; for ZeroMQ sources with a queue, "
+                   "decoder threads (no parallel decoding, events out of order)")
+@click.option('-e', '--event', 'events', type=int, multiple=True,
+              help="decode only the given event number(s)")
+@click.option('--mmap', 'use_mmap', is_flag=True,
+              help="map input files into memory instead of reading them")
+@click.option('--cache/--no-cache', default=True,
+              help="convert o32 files to a binary cache ($PYTRD_CACHE_DIR)")
+@click.option('-f', '--format', 'formats', type=click.Choice(["csv", "bin"]),
+              multiple=True, default=["csv"], help="output format(s) for digits")
+@click.option('--tracklets/--no-tracklets', default=False,
+              help="write tracklets to tracklets.bin")
+@click.option('--queue-size', default=0,
+              help="receive ZeroMQ messages into a queue of this size")
+@click.option('--policy', type=click.Choice(["block", "drop-oldest", "sample"]),
+              default="block", help="what to do with messages if the queue is full")
+def rec_digits(source, loglevel, skip_events, tracklet_format, jobs, events, use_mmap, cache, formats, tracklets, queue_size, policy):
 
     ch = logging.StreamHandler()
     ch.setFormatter(ColorFormatter())
@@ -46,9 +70,38 @@ def rec_digits(source, loglevel, skip_events, tracklet_format):
     logging.getLogger("rawlog").setLevel(logging.WARNING)
 
     # Instantiate the reader that will get events and subevents from the source
-    reader = make_reader(source)
-    reader.add_trd_parser(store_digits=digits_csv_file("digits.csv"), tracklet_format=tracklet_format)
-    reader.process(skip_events=skip_events)
+    reader = make_reader(source, use_mmap=use_mmap, cache=cache,
+                         queue_size=queue_size, policy=policy)
+    outfiles = list()
+    if "csv" in formats:
+        outfiles.append(digits_csv_file("digits.csv"))
+    if "bin" in formats:
+        outfiles.append(DigitFileWriter("digits.bin"))
+
+    def write_digits(digits):
+        for outfile in outfiles:
+            outfile(digits)
+
+    sink = DigitSink(write_digits, chunk_size=10000)
+
+    trackletfile = None
+    tracklet_sink = None
+    if tracklets:
+        trackletfile = TrackletFileWriter("tracklets.bin")
+        tracklet_sink = TrackletSink(trackletfile, chunk_size=10000)
+
+    reader.add_trd_parser(store_digits=sink, store_tracklets=tracklet_sink,
+                          tracklet_format=tracklet_format)
+    # keep what has been decoded if an online source is interrupted
+    try:
+        reader.process(skip_events=skip_events, jobs=jobs, events=events or None)
+    finally:
+        sink.flush()
+        for outfile in outfiles:
+            outfile.close()
+        if tracklet_sink is not None:
+            tracklet_sink.flush()
+            trackletfile.close()
 
     # # The actual parsing of TRD subevents is handled by the LinkParser
     # lp = LinkParser(store_digits=digits_csv_file("digits.csv"))
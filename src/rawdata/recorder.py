@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+#
+# Record the stream of the TRDbox publisher to MiniDAQ files
+#
+# Every message from the publisher contains one subevent. It is written as
+# an event (equipment type 1) with this one subevent, so the files can be
+# read with MiniDaqReader. Messages are received in the main thread and
+# handed to a writer thread, which collects them into batches and writes
+# every batch with a single vectored write. The output is split into files
+# of limited size and/or duration.
+
+import click
+import logging
+import os
+import queue
+import threading
+import time
+import zmq
+from datetime import datetime
+
+from .header import TrdboxHeader
+from .minidaqreader import minidaq_header, MiniDaqHeader
+from .zmqreader import subscribe
+
+logger = logging.getLogger(__name__)
+
+# maximum number of buffers per writev call (IOV_MAX on Linux)
+_max_iov = 1024
+
+
+def minidaq_event(data, received=None):
+    """Wrap a message from the TRDbox publisher into a MiniDAQ event
+
+    Returns a list of buffers, so the message itself is not copied if its
+    header is already a version 1 or 2 MiniDAQ header. Events of more than
+    64 kB get a version 2 event header (see MiniDaqHeader)."""
+
+    header = TrdboxHeader(data)
+
+    if header.version in [1, 2]:
+        sec, nanosec = header.sec, header.nanosec
+    elif received is not None:
+        sec, nanosec = int(received), int(1e9*(received % 1))
+    else:
+        sec, nanosec = 0, 0
+
+    start = header.header_size
+    payload = data[start:start+header.payload_size]
+
+    if header.version in [1, 2] and header.header_size == MiniDaqHeader.header_size:
+        subevent = [data[:start+header.payload_size]]
+    else:
+        subevent = [minidaq_header(header.equipment_type, header.equipment_id,
+                                   len(payload), sec, nanosec), payload]
+
+    size = sum(len(b) for b in subevent)
+    return [minidaq_header(1, 0, size, sec, nanosec)] + subevent
+
+
+class RotatingFileWriter:
+    """Write MiniDAQ events to a series of files in a background thread
+
+    File names are generated from `pattern` with a running file number
+    (`index`) and the start time of the file (`time`, formatted with
+    strftime). A new file is started when the current file would exceed
+    max_size bytes or is older than max_time seconds.
+
+    Events are passed to put() as lists of buffers, the writer thread
+    collects up to batch_size bytes and writes them with os.writev."""
+
+    def __init__(self, pattern="trdbox-{time:%Y%m%d-%H%M%S}-{index:04d}.bin",
+                 max_size=None, max_time=None, batch_size=1<<22, max_queue=0):
+
+        self.pattern = pattern
+        self.max_size = max_size
+        self.max_time = max_time
+        self.batch_size = batch_size
+
+        self.queue = queue.Queue(max_queue)
+        self.fd = None
+        self.index = 0
+        self.files = list()
+        self.written = 0
+        self.events = 0
+
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, buffers):
+        self.queue.put(buffers)
+
+    def close(self):
+        """Write all pending events and close the current file"""
+        self.queue.put(None)
+        self.thread.join()
+
+    def _open(self):
+        self.filename = self.pattern.format(index=self.index, time=datetime.now())
+        logger.info(f"writing to {self.filename}")
+        self.fd = os.open(self.filename, os.O_WRONLY|os.O_CREAT|os.O_TRUNC, 0o644)
+        self.index += 1
+        self.size = 0
+        self.opened = time.monotonic()
+        self.files.append(self.filename)
+
+    def _close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    def _rotate(self, nbytes):
+        if self.fd is None:
+            return True
+        if self.size == 0:
+            return False
+        if self.max_size is not None and self.size + nbytes > self.max_size:
+            return True
+        if self.max_time is not None and time.monotonic() - self.opened > self.max_time:
+            return True
+        return False
+
+    def _write(self, buffers):
+        for i in range(0, len(buffers), _max_iov):
+            iov = buffers[i:i+_max_iov]
+            n = os.writev(self.fd, iov)
+
+            # finish a partial write
+            if n < sum(len(b) for b in iov):
+                rest = memoryview(b"".join(iov))[n:]
+                while len(rest) > 0:
+                    rest = rest[os.write(self.fd, rest):]
+
+    def _run(self):
+        done = False
+        while not done:
+            # wait for the first event, then take what is in the queue
+            batch = list()
+            event = self.queue.get()
+            while event is not None:
+                batch.append((event, sum(len(b) for b in event)))
+                if sum(n for e, n in batch) >= self.batch_size:
+                    break
+                try:
+                    event = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+            done = event is None
+
+            # write the batch, splitting it at file boundaries
+            buffers = list()
+            for event, nbytes in batch:
+                if self._rotate(nbytes):
+                    if len(buffers) > 0:
+                        self._write(buffers)
+                        buffers = list()
+                    self._close()
+                    self._open()
+                buffers.extend(event)
+                self.size += nbytes
+                self.written += nbytes
+                self.events += 1
+
+            if len(buffers) > 0:
+                self._write(buffers)
+
+        self._close()
+
+
+@click.command()
+@click.argument('source', default='tcp://localhost:7776')
+@click.option('-o', '--output', 'pattern',
+              default="trdbox-{time:%Y%m%d-%H%M%S}-{index:04d}.bin",
+              help="file name pattern, with {index} and {time}")
+@click.option('--max-size', type=float, default=1000.,
+              help="start a new file after this many MB")
+@click.option('--max-time', type=float, default=None,
+              help="start a new file after this many seconds")
+@click.option('-n', '--events', 'max_events', type=int, default=None,
+              help="stop after this number of messages")
+@click.option('-e', '--equipment', 'equipments', type=int, multiple=True,
+              help="record only the given equipment type(s)")
+@click.option('-l', '--loglevel', default=logging.INFO)
+def record(source, pattern, max_size, max_time, max_events, equipments, loglevel):
+    """Record the messages of a TRDbox publisher to MiniDAQ files"""
+
+    logging.basicConfig(level=loglevel)
+
+    context = zmq.Context()
+    socket = context.socket(zmq.SUB)
+    socket.setsockopt(zmq.RCVHWM, 0)
+    socket.connect(source)
+    subscribe(socket, equipments or None)
+
+    writer = RotatingFileWriter(pattern, max_size=int(max_size*1e6), max_time=max_time)
+
+    received = 0
+    skipped = 0
+    start = time.monotonic()
+    try:
+        while max_events is None or received < max_events:
+            frame = socket.recv(copy=False)
+            try:
+                writer.put(minidaq_event(frame.buffer, time.time()))
+            except (AssertionError, ValueError) as e:
+                logger.warning(f"skipping message {received}: {e}")
+                skipped += 1
+            received += 1
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        writer.close()
+        elapsed = time.monotonic() - start
+        if skipped > 0:
+            logger.warning(f"{skipped} invalid message(s) could not be recorded")
+        logger.info(f"recorded {writer.events} of {received} messages, "
+                    f"{writer.written/1e6:.1f} MB in {len(writer.files)} file(s), "
+                    f"{writer.written/1e6/max(elapsed,1e-9):.1f} MB/s")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+#
+# Replay MiniDAQ files over a ZeroMQ publisher
+#
+# Every subevent of the file is published as one message, starting with its
+# MiniDAQ header, i.e. with the magic word 0xDA7AFEED and the equipment type
+# that zmqreader subscribes to. This makes it possible to test the online
+# tools without a TRDbox. The messages can be sent as fast as possible, at a
+# fixed rate, or with the original timing of the events.
+
+import click
+import logging
+import math
+import struct
+import time
+import zmq
+
+from .minidaqreader import MiniDaqReader
+
+logger = logging.getLogger(__name__)
+
+# magic, equipment type and id, version, size bits 16-23 (version 2 only),
+# header and payload size of MiniDAQ headers
+_header = struct.Struct("<IBBxBBBH")
+
+
+def subevents(reader, evno):
+    """Yield the subevents of an event in a MiniDAQ file as memoryviews"""
+
+    index = reader.index
+    addr = int(index.offset[evno])
+    data = memoryview(reader.read(addr, int(index.size[evno])))
+
+    pos = 0
+    while pos + _header.size <= len(data):
+        magic, ety, eid, ver, pszhi, hsz, psz = _header.unpack_from(data, pos)
+        if ver == 2:
+            psz |= pszhi << 16
+        if ety == 1:
+            # event header, the subevents follow
+            pos += hsz
+            continue
+        yield data[pos:pos+hsz+psz]
+        pos += hsz + psz
+
+
+class Pacer:
+    """Wait until messages are due
+
+    With rate=None and timing=False, messages are due immediately. With a
+    rate, message i is due i/rate seconds after the start. With timing=True,
+    an event is due at its original time stamp (relative to the first
+    event), divided by `speed`."""
+
+    def __init__(self, rate=None, timing=False, speed=1.0):
+        self.rate = rate
+        self.timing = timing
+        self.speed = speed
+        self.start = None
+        self.first = None
+
+    def wait(self, count, timestamp):
+        now = time.monotonic()
+        if self.start is None:
+            self.start = now
+            self.first = timestamp
+
+        if self.timing:
+            if math.isnan(timestamp) or math.isnan(self.first):
+                return
+            due = self.start + (timestamp - self.first) / self.speed
+        elif self.rate is not None:
+            due = self.start + count / self.rate
+        else:
+            return
+
+        if due > now:
+            time.sleep(due - now)
+
+
+class RateMeter:
+    """Count messages and bytes, and log the rates at regular intervals"""
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.start = self.last = time.monotonic()
+        self.messages = self.bytes = 0
+        self.last_messages = self.last_bytes = 0
+
+    def add(self, nbytes):
+        self.messages += 1
+        self.bytes += nbytes
+
+        now = time.monotonic()
+        if now - self.last >= self.interval:
+            self.report(now - self.last, self.messages - self.last_messages,
+                        self.bytes - self.last_bytes)
+            self.last = now
+            self.last_messages, self.last_bytes = self.messages, self.bytes
+
+    def report(self, elapsed, messages, nbytes, prefix=""):
+        elapsed = max(elapsed, 1e-9)
+        logger.info(f"{prefix}{messages} messages in {elapsed:.1f}s: "
+                    f"{messages/elapsed:.1f} msg/s, {nbytes/elapsed/1e6:.2f} MB/s")
+
+    def summary(self):
+        self.report(time.monotonic() - self.start, self.messages, self.bytes,
+                    prefix="total: ")
+
+
+@click.command()
+@click.argument('files', nargs=-1, required=True)
+@click.option('-b', '--bind', default="tcp://*:7776", help="address of the publisher")
+@click.option('-r', '--rate', type=float, default=None,
+              help="fixed rate in messages per second (default: as fast as possible)")
+@click.option('-t', '--original-timing', 'timing', is_flag=True,
+              help="send events with the timing of the MiniDAQ headers")
+@click.option('--speed', type=float, default=1.0,
+              help="speed-up factor for --original-timing")
+@click.option('-n', '--loops', type=int, default=1,
+              help="number of times to replay the files (0: forever)")
+@click.option('-w', '--wait', type=float, default=1.0,
+              help="seconds to wait for subscribers before sending")
+@click.option('-l', '--loglevel', default=logging.INFO)
+def replay(files, bind, rate, timing, speed, loops, wait, loglevel):
+    """Publish the subevents of MiniDAQ files like the TRDbox"""
+
+    logging.basicConfig(level=loglevel)
+
+    context = zmq.Context()
+    socket = context.socket(zmq.PUB)
+    socket.bind(bind)
+    logger.info(f"publishing on {bind}")
+    time.sleep(wait)
+
+    readers = [MiniDaqReader(f, use_mmap=True) for f in files]
+    meter = RateMeter()
+
+    loop = 0
+    try:
+        while loops == 0 or loop < loops:
+            # the original timing restarts with every pass over the files
+            pacer = Pacer(rate, timing, speed)
+            count = 0
+            for reader in readers:
+                for evno in range(len(reader.index)):
+                    timestamp = float(reader.index.timestamp[evno])
+                    for msg in subevents(reader, evno):
+                        pacer.wait(count, timestamp)
+                        socket.send(msg)
+                        meter.add(len(msg))
+                        count += 1
+            loop += 1
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        meter.summary()
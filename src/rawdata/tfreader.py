@@ -2,12 +2,15 @@
 #
 
 import logging
+import mmap
+import os
 from sqlite3 import DataError
 import numpy as np
-from struct import unpack
+from struct import unpack, unpack_from
 
 from .base import BaseParser, BaseHeader
 from .bitstruct import BitStruct
+from .index import save_index, load_index
 # from .trdfeeparser import make_trd_parser
 
 logger = logging.getLogger(__name__)
@@ -15,7 +18,7 @@ logger = logging.getLogger(__name__)
 
 class DataHeader:
     def __init__(self, rawdata, addr):
-        if not isinstance(rawdata,bytes) or len(rawdata)!=0x60:
+        if not isinstance(rawdata,(bytes,memoryview)) or len(rawdata)!=0x60:
             raise TypeError(f"Invalid DataHeader raw data format {len(rawdata)}")
 
         self._addr = addr
@@ -24,34 +27,35 @@ class DataHeader:
         # self.log(rawdata, addr)
 
     def parse(self, rawdata):
+        # unpack_from works on bytes and memoryviews without slicing
 
         # 1st dword
-        fields = unpack('<4sLLL', rawdata[0x00:0x10])
+        fields = unpack_from('<4sLLL', rawdata, 0x00)
         self.magic = fields[0].rstrip(b'\0').decode()
         self.hdrsize, self.flags, self.version = fields[1:4]
 
         # 2nd dword
-        fields = unpack('<8s4s4s', rawdata[0x10:0x20])
+        fields = unpack_from('<8s4s4s', rawdata, 0x10)
         self.hdrdesc = fields[0].rstrip(b'\0').decode()
         # 2 padding/ignored fields
 
         # 3rd dword
-        # fields = unpack('<16s', rawdata[0x20:0x30])
-        self.datadesc = rawdata[0x20:0x30].rstrip(b'\0').decode()
+        fields = unpack_from('<16s', rawdata, 0x20)
+        self.datadesc = fields[0].rstrip(b'\0').decode()
 
         # 4th dword
-        fields = unpack('<4sL4sL', rawdata[0x30:0x40])
+        fields = unpack_from('<4sL4sL', rawdata, 0x30)
         self.origin = fields[0].rstrip(b'\0').decode()
         # ignore serialization method
         self.nparts = fields[1]
         self.subspec = fields[3]
 
         # 5th dword
-        fields = unpack('<LLQ', rawdata[0x40:0x50])
+        fields = unpack_from('<LLQ', rawdata, 0x40)
         self.subspec, self.part, self.datasize = fields
 
         # 6th dword
-        fields = unpack('<LLL4s', rawdata[0x50:0x60])
+        fields = unpack_from('<LLL4s', rawdata, 0x50)
         self.orbit, self.tfcount, self.runno = fields[0:3]
         
     def __str__(self):
@@ -92,13 +96,18 @@ class RawDataHeader(BaseHeader):
         
     https: // gitlab.cern.ch/AliceO2Group/wp6-doc/-/blob/master/rdh/RDHv6.md"""
 
+    __slots__ = ()
+
+    _hexdump_fmt = ('\033[1;37;40m', '\033[0;37;100m')
+
     def __init__(self,data,addr):
         super().__init__(data,addr)
         assert(self.zero7==0)
-        
-        self._hexdump_desc[0] = "RDHv{version} fee={fee}"
 
-        self._hexdump_fmt = ('\033[1;37;40m', '\033[0;37;100m')
+    def hexdump_desc(self):
+        desc = super().hexdump_desc()
+        desc[0] = f"RDHv{self.version} fee={self.fee}"
+        return desc
 
         # self._hexdump_desc[8:16] = ""
 
@@ -112,37 +121,213 @@ class RawDataHeader(BaseHeader):
         #     "", "", "", ""]
 
 
+def rdh_table(data):
+    """Decode all RDHs in a buffer of RDH pages into a structured array
+
+    Only the datasize field is read to follow the chain of pages, the
+    headers are then unpacked in one go (see BitStruct.unpack_array), e.g.
+    to check all of them with array operations:
+
+        rdh = rdh_table(payload)
+        bad = (rdh['version'] != 6) | (rdh['zero7'] != 0)
+    """
+
+    offsets = list()
+    pos = 0
+    while pos + RawDataHeader.header_size <= len(data):
+        offsets.append(pos)
+        datasize, = unpack_from("<H", data, pos+10)
+        if datasize < RawDataHeader.header_size:
+            raise DataError(f"invalid RDH data size {datasize} at offset {pos}")
+        pos += datasize
+
+    return RawDataHeader.unpack_array(data, offsets)
+
+
+
+
+class TimeFrameIndex:
+    """Inventory of the DataHeaders in a time frame file
+
+    The index is a NumPy structured array with one entry per DataHeader
+    (see `dtype`). The payload of an entry starts at offset+0x60. The index
+    is saved in the cache (see index.py) and reused as long as the size and
+    modification time of the data file are unchanged."""
+
+    suffix = ".idx"
+
+    dtype = np.dtype([
+        ('offset', '<u8'), ('origin', 'S4'), ('datadesc', 'S16'),
+        ('subspec', '<u4'), ('part', '<u4'), ('orbit', '<u4'),
+        ('tfcount', '<u4'), ('datasize', '<u8')])
+
+    def __init__(self, headers):
+        self.headers = headers
+
+    def __len__(self):
+        return len(self.headers)
+
+    @classmethod
+    def scan(cls, read, filesize):
+        """Build the index from the DataHeaders, skipping all payloads
+
+        read(addr, size) has to return the data at the given byte range of
+        the file, see TimeFrameReader.read()."""
+
+        headers = list()
+        addr = 0
+        while addr < filesize:
+            data = read(addr, 0x60)
+            if len(data) < 0x60:
+                if len(data) > 0:
+                    logger.warning(f"incomplete DataHeader at offset {addr}")
+                break
+
+            hdr = DataHeader(data, addr)
+            headers.append((addr, hdr.origin, hdr.datadesc, hdr.subspec,
+                            hdr.part, hdr.orbit, hdr.tfcount, hdr.datasize))
+            addr += 0x60 + hdr.datasize  # skip over payload
+
+        return cls(np.array(headers, dtype=cls.dtype))
+
+    def save(self, filename):
+        """Save the index of the data file `filename`"""
+        save_index(filename, self.suffix, headers=self.headers)
+
+    @classmethod
+    def load(cls, filename):
+        """Load the index of the data file `filename`
+
+        Returns None if there is no index or if it is outdated."""
+
+        idx = load_index(filename, cls.suffix)
+        if idx is None or 'headers' not in idx or idx['headers'].dtype != cls.dtype:
+            return None
+        return cls(idx['headers'])
+
+    def select(self, origin="TRD", orbit=None, subspec=None):
+        """Return the index entries with the given origin, orbit and subspec
+
+        `orbit` and `subspec` can be a single value or a (first, last)
+        range, including both limits. None selects all values."""
+
+        mask = self.headers['origin'] == origin.encode()
+        for field, value in (('orbit', orbit), ('subspec', subspec)):
+            if value is None:
+                continue
+            elif isinstance(value, tuple):
+                mask &= (self.headers[field] >= value[0]) & (self.headers[field] <= value[1])
+            else:
+                mask &= self.headers[field] == value
+
+        return self.headers[mask]
+
+    def payload_ranges(self, origin="TRD", orbit=None, subspec=None):
+        """Byte ranges of the selected payloads as an array of (offset, size)"""
+
+        sel = self.select(origin, orbit, subspec)
+        return np.column_stack((sel['offset'] + 0x60, sel['datasize']))
 
 
 class TimeFrameReader:
     """Reader class for ALICE O2 time frames.
 
-    The class can be used as an iterator over events in the file."""
+    The class can be used as an iterator over events in the file.
+
+    With use_mmap=True, the file is mapped into memory. Headers and
+    payloads are then parsed from slices of the mapped file, without
+    copying them."""
 
-    def __init__(self, filename):
+    def __init__(self, filename, use_mmap=False):
+        self.filename = filename
         self.file = open(filename,"rb")
+        self.filesize = os.fstat(self.file.fileno()).st_size
+
+        # empty files cannot be mapped
+        self.options = dict(use_mmap=use_mmap)
+        self.buffer = None
+        if use_mmap and self.filesize > 0:
+            self.buffer = memoryview(mmap.mmap(
+                self.file.fileno(), 0, access=mmap.ACCESS_READ))
+
         self.parsers = dict()
         # self.log_header = lambda x: x.hexdump()
         self._skipped_stf = dict()
+        self._index = None
 
-    def add_trd_parser(self, **kwargs):
-        # self.parsers['TRD'] = make_trd_parser(has_cruheader=False, **kwargs)  
-        pass
-    
-    def process(self, skip_events=0):
-        while self.file.readable():
-            addr = self.file.tell()
-            data = self.file.read(0x60)
-            if len(data)==0:
-                break
-            hdr = DataHeader(data, addr)
-            self.log_header(hdr)
+    @property
+    def index(self):
+        """The DataHeader index of the file, built on first use"""
 
-            if hdr.origin in self.parsers:
-                self.parsers[hdr.origin].read(self.file, hdr.datasize)
+        if self._index is None:
+            self._index = TimeFrameIndex.load(self.filename)
+
+        if self._index is None:
+            self._index = TimeFrameIndex.scan(self.read, self.filesize)
+            try:
+                self._index.save(self.filename)
+            except OSError as e:
+                logger.warning(f"cannot save DataHeader index: {e}")
+
+        return self._index
+
+    def read_payloads(self, origin="TRD", orbit=None, subspec=None):
+        """Read the selected payloads, without touching any other data
+
+        Yields tuples (offset, data) for all payloads that match the
+        selection of TimeFrameIndex.select()."""
+
+        for offset, size in self.index.payload_ranges(origin, orbit, subspec):
+            yield int(offset), self.read(int(offset), int(size))
+
+    def read(self, addr, size):
+        """Return `size` bytes at offset `addr` of the file
+
+        In mmap mode, the data is a memoryview of the mapped file."""
+
+        if self.buffer is not None:
+            return self.buffer[addr:addr+size]
+
+        self.file.seek(addr)
+        return self.file.read(size)
+
+    def add_trd_parser(self, **kwargs):
+        # trdfeeparser imports this module, import it only when needed
+        from .trdfeeparser import make_trd_parser
+        self.parsers['TRD'] = make_trd_parser(has_cruheader=True, **kwargs)
+
+    def process(self, skip_events=0, jobs=1, events=None):
+        """Decode the payloads of all origins with a parser
+
+        The DataHeaders are looked up in the index, so payloads of other
+        origins are not read at all. Time frames are numbered in the order
+        of their counters in the file, `skip_events` and `events` select
+        time frames by this number."""
+
+        if jobs > 1:
+            logger.warning("parallel decoding is not supported for time frames")
+
+        headers = self.index.headers
+        tfcounts, tfno = np.unique(headers['tfcount'], return_inverse=True)
+        if events is None:
+            events = range(skip_events, len(tfcounts))
+        events = set(events)
+
+        for i, entry in enumerate(headers):
+            origin = entry['origin'].decode()
+            if tfno[i] not in events or (origin not in self.parsers and
+                    not entry['datadesc'].startswith(b"FILE_STF")):
+                self.count_skipped_stf(origin)
+                continue
+
+            addr = int(entry['offset'])
+            self.log_header(DataHeader(self.read(addr, 0x60), addr))
+
+            if origin in self.parsers:
+                parser = self.parsers[origin]
+                parser.set_event(int(tfno[i]))
+                parser.parse(self.read(addr+0x60, int(entry['datasize'])), addr+0x60)
 
-            else:
-                self.file.seek(hdr.datasize, 1)  # skip over payload
         self.log_skipped_stf()
 
     def log_header(self, hdr):
@@ -150,12 +335,14 @@ class TimeFrameReader:
             self.log_skipped_stf()
             logging.getLogger("raw.o2h").info(hdr)
         else:
-            key = hdr.origin
-            # key = f"{hdr.datadesc}:{hdr.origin}"
-            if key in self._skipped_stf:
-                self._skipped_stf[key] += 1
-            else:
-                self._skipped_stf[key] = 1
+            self.count_skipped_stf(hdr.origin)
+
+    def count_skipped_stf(self, key):
+        # key = f"{hdr.datadesc}:{hdr.origin}"
+        if key in self._skipped_stf:
+            self._skipped_stf[key] += 1
+        else:
+            self._skipped_stf[key] = 1
 
     def log_skipped_stf(self):
         if len(self._skipped_stf) > 0:
@@ -163,6 +350,7 @@ class TimeFrameReader:
             for key,count in self._skipped_stf.items():
                 msg += f" {key}({count})"
             logging.getLogger("raw.o2h").info(msg)
+            self._skipped_stf = dict()
 
 
 class RdhStreamParser(BaseParser):
@@ -170,6 +358,9 @@ class RdhStreamParser(BaseParser):
         self.parser = payload_parser
         self.hexdump = lambda x: None # Default: no logging
 
+    def set_event(self, event):
+        self.parser.set_event(event)
+
     def read(self, stream, size):
 
         maxpos = stream.tell()+size
@@ -179,9 +370,28 @@ class RdhStreamParser(BaseParser):
 
             rdh = RawDataHeader.read(stream)
             self.hexdump(rdh)
+            if rdh.datasize < RawDataHeader.header_size:
+                raise DataError(f"invalid RDH data size {rdh.datasize} at offset {rdh._addr}")
             payload_size = rdh.datasize - RawDataHeader.header_size
             self.parser.read(stream, payload_size)
 
+    def parse(self, data, addr):
+        """Parse RDH pages from a buffer, passing payloads as memoryviews"""
+
+        data = memoryview(data)
+        pos = 0
+        while pos < len(data):
+            if len(data) - pos < RawDataHeader.header_size:
+                raise DataError("Insufficient data")
+
+            rdh = RawDataHeader(data[pos:pos+RawDataHeader.header_size], addr+pos)
+            self.hexdump(rdh)
+            if rdh.datasize < RawDataHeader.header_size:
+                raise DataError(f"invalid RDH data size {rdh.datasize} at offset {addr+pos}")
+            start = pos + RawDataHeader.header_size
+            self.parser.parse(data[start:pos+rdh.datasize], addr+start)
+            pos += rdh.datasize
+
 if __name__=="__main__":
     reader = TimeFrameReader(
         "/Users/tom/cernbox/data/noise/504419/o2_rawtf_run00504419_tf00006252.tf")
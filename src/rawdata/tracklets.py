@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# Columnar storage of TRD tracklets
+
+import numpy as np
+from typing import NamedTuple
+
+from .columns import ColumnSink, ColumnFile, ColumnFileWriter
+
+
+class tracklets_t(NamedTuple):
+    """A chunk of tracklets, stored as one NumPy array per column
+
+    Legacy (Run 2) tracklets have no MCM column and get col=-1. Their hcid
+    is taken from the following HC header, and is -1 if there is none."""
+    event: np.ndarray
+    hcid: np.ndarray
+    row: np.ndarray
+    col: np.ndarray
+    position: np.ndarray
+    slope: np.ndarray
+    pid: np.ndarray
+
+    @property
+    def nrows(self):
+        return len(self.event)
+
+
+# data types of the columns of tracklets_t
+tracklet_dtypes = tracklets_t(
+    event = np.dtype("<u4"),
+    hcid = np.dtype("<i2"),
+    row = np.dtype("u1"),
+    col = np.dtype("i1"),
+    position = np.dtype("<i2"),
+    slope = np.dtype("i1"),
+    pid = np.dtype("<u4"))
+
+
+class TrackletSink(ColumnSink):
+    """Collect tracklets in growable NumPy columns
+
+    An instance can be passed as `store_tracklets` to the TRD parser, which
+    calls it once per tracklet. The callback is called with a tracklets_t
+    whenever a chunk is complete (see ColumnSink)."""
+
+    def __init__(self, callback, chunk_size=None, capacity=1024):
+        super().__init__(tracklets_t, tracklet_dtypes, callback, chunk_size,
+                         capacity if chunk_size is None else chunk_size)
+
+    def __call__(self, event, hcid, row, col, position, slope, pid):
+        self.append(1, event, hcid, row, col, position, slope, pid)
+
+
+tracklet_file = ColumnFile(tracklets_t, tracklet_dtypes, b"TRDTRKLT", name="tracklet")
+
+
+class TrackletFileWriter(ColumnFileWriter):
+    """Write chunks of tracklets (see TrackletSink) to a binary file"""
+
+    def __init__(self, filename="tracklets.bin"):
+        super().__init__(tracklet_file, filename)
+
+
+def read_tracklets(filename):
+    """Map a binary tracklet file into memory
+
+    Returns a tracklets_t whose columns are read-only NumPy views of the file."""
+
+    return tracklet_file.read(filename)
@@ -1,12 +1,11 @@
 import numpy as np
-from struct import unpack
 
 from functools import wraps
-from collections import namedtuple
+from collections import namedtuple, deque
 import logging
 from termcolor import colored
 
-from rawdata.tfreader import RawDataHeader
+from rawdata.tfreader import RawDataHeader, RdhStreamParser
 
 from .rawlogging import TermColorFilter
 from .constants import eodmarker,eotmarker
@@ -31,6 +30,27 @@ logger.getChild("mcm.MSK").addFilter(TermColorFilter("blue"))
 logger.getChild("mcm.ADC").addFilter(TermColorFilter("grey"))
 logger.getChild("mcm.EOD").addFilter(TermColorFilter("bold_blue"))
 
+# All categories of hexdump messages produced by the parsers
+hexdump_categories = (
+	"trkl.TKH", "trkl.TKD", "trkl.TKL", "trkl.EOT",
+	"hc.HC0", "hc.HC1", "hc.HC2", "hc.HC3",
+	"mcm.MCM", "mcm.MSK", "mcm.ADC", "mcm.EOD",
+	"cru.PAD", "SKP")
+
+def hexdump_loggers(level=logging.INFO):
+	"""Map every hexdump category to its logger, or to None if disabled
+
+	The parsers look up their category in this table and skip the
+	formatting of messages entirely for disabled categories. The table is
+	built when a parser is constructed, so changes to the logging
+	configuration after that time are not taken into account."""
+
+	loggers = dict()
+	for category in hexdump_categories:
+		lg = logger.getChild(category)
+		loggers[category] = lg if lg.isEnabledFor(level) else None
+	return loggers
+
 
 class decode:
 	"""Decorator decoder class for 32-bit data words from TRAPconfig
@@ -40,7 +60,12 @@ class decode:
 	to help with the parsing of data words according to	this format. If the
 	parsing succeeds, the function is called with an additional argument that
 	contains the extracted fields as a namedtuple. An assertion error is
-	raised dif the parsing fails.
+	raised if the parsing fails.
+
+	The bits marked as '0' or '1' in the pattern are stored as a validation
+	mask and value in the `decoder` attribute of the decorated function. The
+	readlist engine uses them to select the matching parser for a dword
+	(see `expect`) without calling parsers that would reject it.
 	
 	An extension to the TRAP format is that uppercase characters indicate
 	that the corresponding bit must be inverted. This is handy for tracklets,
@@ -93,6 +118,7 @@ class decode:
 			assert( (dword & self.validate_mask) == self.validate_value)
 			return func(*args,self.decode(dword ^ self.invert_mask))
 
+		wrapper.decoder = self
 		return wrapper
 
 	def decode(self,dword):
@@ -102,10 +128,13 @@ class describe:
 	"""Decorator to generate messages about dwords
 
 	Probably this function is overkill and should be replaced with a single
-	log statement in the decorated functions."""
+	log statement in the decorated functions.
+
+	The message is only formatted if the category `stream` is enabled in
+	the `loggers` table of the parsing context."""
 
 	def __init__(self, stream, fmt):
-		self.logger = logger.getChild(stream)
+		self.stream = stream
 		self.format = fmt
 		self.marker = ('#', '#', '|', ':')
 
@@ -116,19 +145,18 @@ class describe:
 
 			if fields is None:
 				retval = func(ctx,dword)
-				fielddata = {}
-
 			else:
 				retval = func(ctx,dword,fields)
-				fielddata = fields._asdict()
 
 			if retval is True or retval is None:
 				retval = dict()
 
-			if 'description' not in retval:
+			log = ctx.loggers[self.stream]
+			if log is not None and 'description' not in retval:
+				fielddata = {} if fields is None else fields._asdict()
 				# if (dword & 0x3) == 2:
 				# mrk = ('#', '#', '|', ':')[dword&0x3]
-				self.logger.info(self.format.format(
+				log.info(self.format.format(
 					dword=dword, mark=self.marker[dword & 0x3],
 					**fielddata, ctx=ctx),
 					extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
@@ -140,22 +168,87 @@ class describe:
 
 
 
-ParsingContext = namedtuple('ParsingContext', [
-  'major', 'minor', 'nhw', 'sm', 'stack', 'layer', 'side', #from HC0
-  'ntb', 'bc_counter', 'pre_counter', 'pre_phase', # from HC1
-  'SIDE', 'HC', 'VER', 'det', ## derived from HCx
-  'rob', 'mcm', ## from MCM header
-  'store_digits', ## links to helper functions/functors
-  'event', ## event number
-])
+class expect:
+	"""Readlist entry with the candidate parsers for the next dword
+
+	Each candidate is compiled into a (mask, value) predicate, taken from the
+	`decode` pattern of the parser. Parsers without a pattern accept every
+	dword. Calling the entry with a dword returns the first candidate whose
+	predicate matches, or None if no candidate accepts the dword. The order
+	of the candidates therefore matters for ambiguous patterns, e.g. the
+	end-of-tracklet marker has to be checked before legacy tracklets.
+
+	An entry can stand for a run of `repeat` consecutive dwords with the
+	same candidates, e.g. several additional HC headers."""
+
+	def __init__(self, *candidates, repeat=1):
+		self.candidates = candidates
+		self.repeat = repeat
+		self.table = tuple(
+			(*self.predicate(fct), fct) for fct in candidates)
+
+	@staticmethod
+	def predicate(fct):
+		"""Return the validation mask and value for a parser"""
+
+		# parsers can be functions or callable objects
+		decoder = getattr(fct, 'decoder', None)
+		if decoder is None:
+			decoder = getattr(type(fct).__call__, 'decoder', None)
+
+		if decoder is None:
+			return (0, 0)
+		else:
+			return (decoder.validate_mask, decoder.validate_value)
+
+	def __call__(self, dword):
+		for mask, value, fct in self.table:
+			if (dword & mask) == value:
+				return fct
+		return None
+
+	def __iter__(self):
+		return iter(self.candidates)
+
+
+class ParsingContext:
+	"""State of a TrdFeeParser that is shared by the parsing functions
+
+	Every parser owns its own context, so that several parsers can decode
+	different links or files at the same time without interfering with
+	each other. Fields that have not been decoded yet are None."""
+
+	__slots__ = (
+	  'major', 'minor', 'nhw', 'sm', 'stack', 'layer', 'side', #from HC0
+	  'ntb', 'bc_counter', 'pre_counter', 'pre_phase', # from HC1
+	  'SIDE', 'HC', 'VER', 'det', ## derived from HCx
+	  'rob', 'mcm', ## from MCM header
+	  'store_digits', 'store_mcm', 'store_tracklets', ## links to helper functions/functors
+	  'tracklets', ## legacy tracklets waiting for the HC header
+	  'loggers', ## hexdump loggers, None for disabled categories
+	  'event', ## event number
+	  'current_linkpos', 'current_dword', ## position of the parser
+	)
+
+	def __init__(self, store_digits=None, loggers=None, store_tracklets=None):
+		for k in self.__slots__:
+			setattr(self, k, None)
+
+		self.event = 0
+		self.store_digits = store_digits
+		self.store_tracklets = store_tracklets
+		self.tracklets = list()
+		self.loggers = loggers
+
+		# digit sinks can accept all digits of an MCM in a single call
+		self.store_mcm = getattr(store_digits, 'store_mcm', None)
 
 # ------------------------------------------------------------------------
 # Generic dwords
 
 @describe("SKP", "... skip parsing ...")
 def skip_until_eod(ctx, dword):
-	assert(dword != eodmarker)
-	return dict(readlist=[[parse_eod, skip_until_eod]])
+	return dict(readlist=[expect(parse_eod, skip_until_eod)])
 
 @describe("SKP", "{mark} ... trying to find: eod | mcmhdr - {dword:X}")
 def find_eod_mcmhdr(ctx, dword):
@@ -167,24 +260,22 @@ def find_eod_mcmhdr(ctx, dword):
 		return parse_mcmhdr(ctx,dword)
 
 	# assert(dword != eodmarker)
-	return dict(readlist=[[find_eod_mcmhdr]])
+	return dict(readlist=[expect(find_eod_mcmhdr)])
 
-def parse_eot(ctx, dword):
-	assert(dword == eotmarker)
-	logger.getChild("trkl.EOT").info("end of tracklets", extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
-	return dict(readlist=[[parse_eot, parse_cru_padding, parse_hc0]])
+@decode("0001 : 0000 : 0000 : 0000 : 0001 : 0000 : 0000 : 0000") # eotmarker
+@describe("trkl.EOT", "end of tracklets")
+def parse_eot(ctx, dword, fields):
+	return dict(readlist=[expect(parse_eot, parse_cru_padding, parse_hc0)])
 
-def parse_eod(ctx, dword):
-	assert(dword == eodmarker)
-	logger.getChild("mcm.EOD").info("end of data",
-                                  extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
-	return dict(readlist=[[parse_eod, parse_cru_padding]])
+@decode("0000 : 0000 : 0000 : 0000 : 0000 : 0000 : 0000 : 0000") # eodmarker
+@describe("mcm.EOD", "end of data")
+def parse_eod(ctx, dword, fields):
+	return dict(readlist=[expect(parse_eod, parse_cru_padding)])
 
-def parse_cru_padding(ctx, dword):
-	assert(dword == 0xEEEEEEEE)
-	logger.getChild("cru.PAD").info("padding",
-                                 extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
-	return dict(readlist=[[parse_cru_padding]])
+@decode("1110 : 1110 : 1110 : 1110 : 1110 : 1110 : 1110 : 1110")
+@describe("cru.PAD", "padding")
+def parse_cru_padding(ctx, dword, fields):
+	return dict(readlist=[expect(parse_cru_padding)])
 
 # ------------------------------------------------------------------------
 # Tracklet data
@@ -192,10 +283,15 @@ def parse_cru_padding(ctx, dword):
 # @decode("ffff : tttt : tttt : tttt : ttt0 : ssss : sppp : ccci") # should be correct
 @decode("ffff : tttt : tttt : tttt : ttt1 : SSSS : SPPP : CCCI")
 def parse_tracklet_hc_header(ctx, dword, fields):
-	hc = f"{fields.s:02}_{fields.c}_{fields.p}{'A' if fields.i==0 else 'B'}"
 	hcid = 60*fields.s + 12*fields.c + 2*fields.p + fields.i
-	logger.getChild("trap.TRK").info("HC header {hc} (hcid {hcid})")
-	return dict(readlist=[[parse_tracklet_mcm_header(hcid), parse_eot]])
+
+	log = ctx.loggers["trkl.TKH"]
+	if log is not None:
+		hc = f"{fields.s:02}_{fields.c}_{fields.p}{'A' if fields.i==0 else 'B'}"
+		log.info(f"HC header {hc} (hcid {hcid})",
+			extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+
+	return dict(readlist=[expect(parse_eot, parse_tracklet_mcm_header(hcid))])
 
 
 class parse_tracklet_mcm_header:
@@ -207,20 +303,22 @@ class parse_tracklet_mcm_header:
 	@decode("1zzz : zyyc : cccc : cccb: bbbb : bbba : aaaa : aaa1")
 	def __call__(self, ctx, dword, fields):
 		pid = tuple((fields.a, fields.b, fields.c))
-		mcm = f"{fields.z//4 + self.hcid%2}:{4*(fields.z%4) + fields.y:02d}"
 
-		logger.getChild("trkl.TKD").info(
-		    f"    MCM {mcm} row={fields.z} col={fields.y} pid = {pid[0]} / {pid[1]} / {pid[2]}",
-			extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+		log = ctx.loggers["trkl.TKD"]
+		if log is not None:
+			mcm = f"{fields.z//4 + self.hcid%2}:{4*(fields.z%4) + fields.y:02d}"
+			log.info(
+			    f"    MCM {mcm} row={fields.z} col={fields.y} pid = {pid[0]} / {pid[1]} / {pid[2]}",
+				extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
 
 		rl = list()
 		for p in pid:
 			if p != 0xFF:
-				rl.append([parse_tracklet_word(self.hcid, p, fields.z, fields.y)])
+				rl.append(expect(parse_tracklet_word(self.hcid, p, fields.z, fields.y)))
 
 		# rl = list([parse_tracklet_word(self.hcid, p, fields.z, fields.y)] for p in pid if p != 0)
 
-		rl.append([parse_tracklet_mcm_header(self.hcid), parse_eot])
+		rl.append(expect(parse_eot, parse_tracklet_mcm_header(self.hcid)))
 		return dict(readlist=rl)
 
 class parse_tracklet_word:
@@ -234,15 +332,40 @@ class parse_tracklet_word:
 	@decode("yyyy : yyyY : yyyp : pppp : pppp : pppd : dddD : ddd0")
 	def __call__(self, ctx, dword, fields):
 		self.pid |= fields.p
-		logger.getChild("trkl.TKD").info(
-			f"        y={fields.y} dy={fields.d} pid={self.pid}",
-			extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+
+		log = ctx.loggers["trkl.TKD"]
+		if log is not None:
+			log.info(f"        y={fields.y} dy={fields.d} pid={self.pid}",
+				extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+
+		if ctx.store_tracklets is not None:
+			# position and slope are signed 11-bit and 8-bit values
+			position = fields.y - ((fields.y & 0x400) << 1)
+			slope = fields.d - ((fields.d & 0x80) << 1)
+			ctx.store_tracklets(ctx.event, self.hcid, self.row, self.col,
+				position, slope, self.pid)
 
 @decode("pppp : pppp : zzzz : dddd : dddy : yyyy : yyyy : yyyy")
 @describe("trkl.TKL", "row={z} pos={y} slope={d} pid={p}")
 def parse_legacy_tracklet(ctx, dword, fields):
-	assert(dword != eotmarker)
-	return dict(readlist=[[parse_legacy_tracklet, parse_eot]])
+	# The pattern accepts any dword, the end-of-tracklet marker has to be
+	# checked first by listing parse_eot before this function.
+
+	# Legacy tracklets precede the HC header, they are stored once the
+	# half-chamber is known. Position and slope are signed 13-bit and
+	# 7-bit values.
+	if ctx.store_tracklets is not None:
+		position = fields.y - ((fields.y & 0x1000) << 1)
+		slope = fields.d - ((fields.d & 0x40) << 1)
+		ctx.tracklets.append((fields.z, -1, position, slope, fields.p))
+
+	return dict(readlist=[expect(parse_eot, parse_legacy_tracklet)])
+
+def store_legacy_tracklets(ctx, hcid):
+	"""Store the pending legacy tracklets with the given hcid"""
+	for row, col, position, slope, pid in ctx.tracklets:
+		ctx.store_tracklets(ctx.event, hcid, row, col, position, slope, pid)
+	del ctx.tracklets[:]
 
 
 # ------------------------------------------------------------------------
@@ -260,7 +383,12 @@ def parse_hc0(ctx, dword, fields):
 	ctx.stack = fields.c  # (dword >>  3) & 0x3
 	ctx.side  = fields.i  # (dword >>  2) & 0x1
 
-	ctx.det = 18*ctx.sm + 6*ctx.stack + ctx.layer
+	# 30 chambers per supermodule: 5 stacks with 6 layers
+	ctx.det = 30*ctx.sm + 6*ctx.stack + ctx.layer
+
+	if ctx.tracklets:
+		# same numbering as the Run 3 tracklet HC header
+		store_legacy_tracklets(ctx, 60*ctx.sm + 12*ctx.stack + 2*ctx.layer + ctx.side)
 
 	# An alternative to update the context - which one is easier to read?
 	# (ctx.major,ctx.minor,ctx.nhw,ctx.sm,ctx.layer,ctx.stack,ctx.side) = fields
@@ -278,13 +406,13 @@ def parse_hc0(ctx, dword, fields):
 	ctx.HC   = f"{fields.s:02}_{fields.c}_{fields.p}{side}"
 
 	readlist = list()
-	for i in range(ctx.nhw):
+	if ctx.nhw > 0:
 		# check additional HC header in with HC1 last, because HC2 and HC3
 		# appear like HC1 with the (invalid) phase >= 12. This order avoids
 		# this ambiguity.
-		readlist.append([parse_hc3, parse_hc2, parse_hc1])
+		readlist.append(expect(parse_hc3, parse_hc2, parse_hc1, repeat=ctx.nhw))
 
-	readlist.append([parse_mcmhdr])
+	readlist.append(expect(parse_mcmhdr))
 	return dict(readlist=readlist)
 
 @decode("tttt : ttbb : bbbb : bbbb : bbbb : bbpp : pphh : hh01")
@@ -317,170 +445,221 @@ def parse_mcmhdr(ctx, dword, fields):
 	ctx.rob = fields.r
 	ctx.mcm = fields.m
 	if ctx.major & 0x20:   # Zero suppression
-		return dict(readlist=[[parse_adcmask]])
+		return dict(readlist=[expect(parse_adcmask)])
 
 	else:  # No ZS -> read 21 channels, then expect next MCM header or EOD
-		adcdata = np.zeros(ctx.ntb, dtype=np.uint16)
 		readlist = list()
-		for ch in range(21):
-			for tb in range(0, ctx.ntb, 3):
-				readlist.append([parse_adcdata(channel=ch, timebin=tb, adcdata=adcdata)])
-
-		readlist.append([parse_mcmhdr, parse_eod])
+		readlist.append(parse_adcblock(channels=range(21), ntb=ctx.ntb))
+		readlist.append(expect(parse_mcmhdr, parse_eod))
 		return dict(readlist=readlist)
 
 @decode("nncc : cccm : mmmm : mmmm : mmmm : mmmm : mmmm : 1100")
 def parse_adcmask(ctx, dword, fields):
-	desc = ""
-	count = 0
+	channels = tuple(ch for ch in range(21) if fields.m & (1<<ch))
+
 	readlist = list()
+	readlist.append(parse_adcblock(channels=channels, ntb=ctx.ntb))
+	readlist.append(expect(parse_mcmhdr, parse_eod))
 
-	adcdata = np.zeros(ctx.ntb, dtype=np.uint16)
+	if len(channels) != (~fields.c & 0x1F):
+		logger.getChild("mcm.MSK").error(
+			f"channel count mismatch: {describe_adcmask(fields)}",
+			extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+		return dict(readlist=[expect(find_eod_mcmhdr)])
 
+	log = ctx.loggers["mcm.MSK"]
+	if log is not None:
+		log.info(describe_adcmask(fields),
+			extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+
+	return dict(readlist=readlist)
+
+def describe_adcmask(fields):
+	"""Log message for an ADC mask word"""
+	desc = ""
 	for ch in range(21):
 		if ch in [9,19]:
 			desc += " "
-
-		if fields.m & (1<<ch):
-			count += 1
-			desc += str(ch%10)
-			for tb in range ( 0, ctx.ntb , 3 ):
-				readlist.append([parse_adcdata(channel=ch, timebin=tb, adcdata=adcdata)])
-		else:
-			desc += "."
-
+		desc += str(ch%10) if fields.m & (1<<ch) else "."
 
 	desc += f"  ({~fields.c & 0x1F} channels)"
-	readlist.append([parse_mcmhdr, parse_eod])
-	assert( count == (~fields.c & 0x1F) )
-
-	logger.getChild("mcm.MSK").info(desc, 
-		extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
-	return dict(readlist=readlist)
+	return desc
 
 
 # ------------------------------------------------------------------------
 # Raw data
-class parse_adcdata:
-	"""ADC data parser
-
-	To parse ADC data, we need to know the channel number and the timebins
-	in this dword. I don't think this data should be kept in the context.
-	The parser for the MCM header / adcmask therefore stores it in the parser
-	for the ADC data word. This parser therefore has to be a callable object.
+class parse_adcblock:
+	"""Bulk parser for the ADC data of one MCM
+
+	The ADC data of an MCM is a block of fixed size: every channel that is
+	read out (all 21 without zero suppression, the channels in the ADC mask
+	otherwise) contributes ceil(ntb/3) dwords with three 10-bit ADC values
+	each. Instead of parsing these dwords one by one, the parser hands the
+	whole block to this object as a NumPy uint32 array. All ADC values are
+	extracted in a few vectorized operations into an array of shape
+	(nchannels, ntb).
+
+	The readlist engine recognizes instances of this class and reads
+	`ndwords` dwords at once instead of a single dword.
 	"""
 
-	def __init__(self, channel, timebin, adcdata=None):
-		self.channel = channel
-		self.timebin = timebin
-		self.adcdata = adcdata
-		self.__name__ = "parse_adcdata"
+	repeat = 1
 
-	# @decode("xxxx:xxxx:xxyy:yyyy:yyyy:zzzz:zzzz:zzff")
-	def __call__(self, ctx, dword):
-		x = (dword & 0xFFC00000) >> 22
-		y = (dword & 0x003FF000) >> 12
-		z = (dword & 0x00000FFC) >>  2
-		f = (dword & 0x00000003) >>  0
+	def __init__(self, channels, ntb):
+		self.channels = tuple(channels)
+		self.ntb = ntb
+		self.nwords = (ntb+2) // 3  # dwords per channel
+		self.ndwords = len(self.channels) * self.nwords
+		self.__name__ = f"parse_adcblock(nch={len(self.channels)},ntb={ntb})"
 
-		msg = f"{('#', '#', '|', ':')[dword&3]} "
-		msg += f"ch {self.channel:2} " if self.timebin==0 else " "*6
-		msg += f"tb {self.timebin:2} (f={f})   {x:4}  {y:4}  {z:4}"
+	def __call__(self, ctx, data):
+		data = data.reshape(len(self.channels), self.nwords)
 
-		logger.getChild("mcm.ADC").info(msg,
-                                 extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos))
+		adc = np.empty((len(self.channels), self.nwords, 3), dtype=np.uint16)
+		adc[:, :, 0] = (data >> 22) & 0x3FF
+		adc[:, :, 1] = (data >> 12) & 0x3FF
+		adc[:, :, 2] = (data >>  2) & 0x3FF
+		adc = adc.reshape(len(self.channels), 3*self.nwords)[:, :self.ntb]
 
-		# assert( f == 2 if self.channel%2 else 3)
+		log = ctx.loggers["mcm.ADC"]
+		if log is not None:
+			for i, dword in enumerate(data.ravel().tolist()):
+				log.info(
+					describe_adcdata(dword, self.channels[i // self.nwords],
+					                 3 * (i % self.nwords)),
+					extra=dict(hexdata=dword, hexaddr=ctx.current_linkpos+4*i))
 
-		if self.adcdata is not None and ctx.store_digits is not None:
-			# store the ADC values in the reserved array
-			for i,adc in enumerate((x,y,z)):
-				if self.timebin+i < len(self.adcdata):
-					self.adcdata[self.timebin+i] = adc
+		if ctx.store_mcm is not None:
+			ctx.store_mcm(ctx.event, ctx.det, ctx.rob, ctx.mcm, self.channels, adc)
 
-			# if this is the last dword for this channel -> store the digit
-			if self.timebin+3 >= len(self.adcdata):
-				ctx.store_digits(ctx.event, ctx.det, ctx.rob, ctx.mcm,
-				                 self.channel, self.adcdata)
+		elif ctx.store_digits is not None:
+			for ch, adcdata in zip(self.channels, adc):
+				ctx.store_digits(ctx.event, ctx.det, ctx.rob, ctx.mcm, ch, adcdata)
 
 		return dict()
 
+def describe_adcdata(dword, channel, timebin):
+	"""Log message for an ADC data word"""
+	msg = f"{('#', '#', '|', ':')[dword&3]} "
+	msg += f"ch {channel:2} " if timebin==0 else " "*6
+	msg += f"tb {timebin:2} (f={dword&3})   "
+	msg += f"{(dword>>22)&0x3FF:4}  {(dword>>12)&0x3FF:4}  {(dword>>2)&0x3FF:4}"
+	return msg
+
 
 # ------------------------------------------------------------------------
 class TrdFeeParser:
 
 	#Defining the initial variables for class
-	def __init__(self, store_digits = None, tracklet_format = "run3"):
-		self.ctx = ParsingContext
-		self.ctx.event = 0
-		self.ctx.store_digits = store_digits
+	def __init__(self, store_digits = None, tracklet_format = "run3", store_tracklets = None):
+		# Check once which hexdump categories are enabled. Parsers get None
+		# as logger for disabled categories and skip all formatting.
+		self.ctx = ParsingContext(store_digits, loggers=hexdump_loggers(),
+			store_tracklets=store_tracklets)
 		self.readlist = None
+		self.remaining = 0 # repetitions left for the current readlist entry
 
 		if tracklet_format == "run3":
-			self.readlist_start = [ list([parse_tracklet_hc_header, parse_eot]) ]
+			self.readlist_start = [ expect(parse_eot, parse_tracklet_hc_header) ]
 		elif tracklet_format == "run2":
-			self.readlist_start = [ list([parse_legacy_tracklet, parse_eot]) ]
+			self.readlist_start = [ expect(parse_eot, parse_legacy_tracklet) ]
 		elif tracklet_format == "auto":
-			self.readlist_start = [ list([parse_tracklet_hc_header, parse_legacy_tracklet, parse_eot]) ]
+			self.readlist_start = [ expect(parse_eot, parse_tracklet_hc_header, parse_legacy_tracklet) ]
 		else:
 			raise ValueError(f"Invalid tracklet format '{tracklet_format}'")
 
 	def next_event(self):
 		self.ctx.event += 1
 
+	def set_event(self, event):
+		self.ctx.event = event
+
 	def parse(self, stream, size):
+		"""Read `size` bytes of link data from a stream and parse them"""
+		addr = stream.tell()
+		self.parse_buffer(stream.read(size), addr)
+
+	def parse_buffer(self, data, addr=0):
+		"""Parse the data of one link from a buffer
 
-		self.ctx.current_linkpos = -1
+		Arguments:
+		  data : bytes, memoryview or NumPy uint32 array with the link data
+		  addr : int - location of the data for logging, e.g. the offset
+		         in a file. The address of the i-th dword is addr+4*i."""
 
-		# if self.readlist is None:
-		# 	self.reset()
+		# interpret the buffer as little-endian dwords without copying it
+		nbytes = memoryview(data).nbytes
+		if nbytes % 4:
+			logger.warning(f"ignoring {nbytes%4} bytes after last complete dword")
+		words = np.frombuffer(data, dtype="<u4", count=nbytes//4)
 
-		# Initialize the readlist
-		self.readlist = self.readlist_start.copy()
+		# iterating over Python ints is much faster than over NumPy scalars
+		dwords = words.tolist()
 
-		maxpos = stream.tell() + size
-		while stream.tell() < maxpos:
+		ctx = self.ctx
+		ctx.current_linkpos = -1
 
-			self.ctx.current_linkpos = stream.tell()
-			dword = unpack("<L", stream.read(4))[0]
-			self.ctx.current_dword = dword
+		# Initialize the readlist: a queue of expected dwords, where each
+		# entry can stand for a run of several dwords
+		self.readlist = deque(self.readlist_start)
+		self.remaining = 0
 
-			try:
-				expected = self.readlist.pop(0)
-				for fct in expected:
+		i = 0
+		while i < len(dwords):
 
-					# The function can raise an AssertionError to signal that
-					# it does not understand the dword
-					try:
-						 result = fct(self.ctx,dword)
+			ctx.current_linkpos = addr + 4*i
 
-					except AssertionError as ex:
-						continue
+			if self.remaining == 0:
+				if len(self.readlist) == 0:
+					logger.error(f"extra data after end of readlist at 0x{ctx.current_linkpos:012X}")
+					break
 
-					if not isinstance(result, dict):
-						break
+				expected = self.readlist.popleft()
+				self.remaining = expected.repeat
 
-					if 'readlist' in result:
-						self.readlist.extend(result['readlist'])
+			self.remaining -= 1
 
+			# Blocks of ADC data are decoded in one go
+			if isinstance(expected, parse_adcblock):
+				end = i + expected.ndwords
+				if end > len(dwords):
+					logger.error(f"truncated ADC data: expected {4*expected.ndwords} bytes, "
+					             f"found {4*(len(dwords)-i)}")
 					break
 
-				else:
-					logger.error(f"NO MATCH - expected {[x.__name__ for x in expected]} found {dword:08x}")
-					# check_dword(dword)
+				expected(ctx, words[i:end])
+				i = end
+				continue
+
+			dword = dwords[i]
+			ctx.current_dword = dword
+			i += 1
 
-					# skip everything until EOD
-					self.readlist.extend([[find_eod_mcmhdr]])
-					continue
+			# Select the parser based on the validation patterns
+			fct = expected(dword)
+
+			if fct is None:
+				logger.error(f"NO MATCH - expected {[x.__name__ for x in expected]} found {dword:08x}")
+				# check_dword(dword)
+
+				# skip everything until EOD
+				self.readlist.append(expect(find_eod_mcmhdr))
+				continue
 
+			result = fct(ctx,dword)
+			if isinstance(result, dict) and 'readlist' in result:
+				self.readlist.extend(result['readlist'])
 
-			except IndexError:
-				logger.error(logflt.where + "extra data after end of readlist")
-				break
+		# legacy tracklets without HC header
+		if ctx.tracklets:
+			store_legacy_tracklets(ctx, -1)
 
 	def dump_readlist(self):
-		for j,l in enumerate(self.readlist):
-			print( [ f.__name__ for f in self.readlist[j] ] )
+		for expected in self.readlist:
+			if isinstance(expected, parse_adcblock):
+				print(expected.__name__)
+			else:
+				print( [ f.__name__ for f in expected ], f"x{expected.repeat}" )
 
 
 @BitStruct(  # each line corresponds to a 64-bit word
@@ -493,14 +672,39 @@ class TrdFeeParser:
    	s08=16, s09=16, s10=16, s11=16, 
 	s12=16, s13=16, s14=16, res3=16)
 class TrdHalfCruHeader(BaseHeader):
-	def __init__(self, *args, **kwargs):
-		super().__init__(*args, **kwargs)
 
-		# build tuples with error flags and data size for each link
-		self.errflags = tuple(getattr(self,f"e{i:02}") for i in range(15))
-		self.datasize = tuple(32*getattr(self,f"s{i:02}") for i in range(15))
+	# tuples with error flags, data size and offset for each link, they are
+	# built on first access
+	__slots__ = ('_errflags', '_datasize', '_offset')
+
+	def __init__(self, data, addr):
+		super().__init__(data, addr)
+		self._errflags = None
+		self._datasize = None
+		self._offset = None
+
+	@property
+	def errflags(self):
+		if self._errflags is None:
+			self._errflags = tuple(getattr(self,f"e{i:02}") for i in range(15))
+		return self._errflags
+
+	@property
+	def datasize(self):
+		if self._datasize is None:
+			self._datasize = tuple(32*getattr(self,f"s{i:02}") for i in range(15))
+		return self._datasize
+
+	@property
+	def offset(self):
+		"""The expected offset for each link"""
+
+		if self._offset is None:
+			self._offset = self._link_offsets()
+		return self._offset
+
+	def _link_offsets(self):
 
-		# calculate the expected offset for each link
 		base = self._addr - RawDataHeader.header_size # RDH base address
 		pagesize = 0x2000 - RawDataHeader.header_size # payload per RDH page
 
@@ -519,20 +723,16 @@ class TrdHalfCruHeader(BaseHeader):
 			# HexDump.add_marker(expect, "HCRU: Link{02i}")
 			rawoffset += sz
 
-		self.offset = tuple(offsets)
-		# for i, off in enumerate(self.offset):
-		# 	logger.info(f"Link {i} expected to start at 0x{off:06x}")
+		return tuple(offsets)
 
-		# for i, desc in enumerate(self._hexdump_desc):
-		# 	self._hexdump_desc[i] = f"HCRU[{i//4}.{i%4}]  {desc}"
-		# logger.info(self._hexdump_desc)
-
-		self._hexdump_desc[0] = "HCRU version={version} cru=0x{cru:03X} evtype=0x{evtype:X}"
+	def hexdump_desc(self):
+		desc = super().hexdump_desc()
+		desc[0] = f"HCRU version={self.version} cru=0x{self.cru:03X} evtype=0x{self.evtype:X}"
 
 		for i in range(15):
-			self._hexdump_desc[i+1] = f"Link {i:02d}: {self.fmtlink(i)}"
-		# # self._hexdump_desc[15] = f"HCRU[3.3]  14: {self.fmtlink(14)}"
-		# self._hexdump_desc = HexDump.colorize(self._hexdump_desc)
+			desc[i+1] = f"Link {i:02d}: {self.fmtlink(i)}"
+		# # desc[15] = f"HCRU[3.3]  14: {self.fmtlink(14)}"
+		return desc
 
 	def fmtlink(self, linkno):
 		if self.errflags[linkno] == 0:
@@ -551,87 +751,86 @@ class TrdCruParser(BaseParser):
 		else:
 			self.feeparser = trdfeeparser
 
+		self.hexdump = lambda x: None # Default: no logging
+
 		# We might have to resume reading data from the previous RDH page.
 		# All necessary data to resume at the correct position is therefore
 		# stored in instance instead of local variables.
 		self.hcruheader = None
 		self.link = None
 		self.unread = None # bytes remaining to be parse in current link
+		self.chunks = list() # (data, addr) of the current link so far
 
+	def set_event(self, event):
+		self.feeparser.set_event(event)
 
-	def read(self, stream, size):
+	def parse(self, data, addr):
+		"""Parse the payload of one RDH page
 
-		# hdump = HexDump()
-		# hdump._markers[0x00000000BB88] = ["here"]
+		Half-CRU headers are followed by the data of 15 links, which can
+		continue on the next page. The data of a link is collected until
+		it is complete, and then passed to the FEE parser."""
 
-		startpos = stream.tell()
-		maxpos = startpos + size
-		while stream.tell() < maxpos:
-
-			avail_bytes = maxpos - stream.tell()
-			if avail_bytes == 32:
-				padding = stream.read(32)
-				if padding != '\xee'*32:
-					pass
-					# raise ValueError(f"invalid padding word: {padding} {len(padding)}")
-				continue
+		data = memoryview(data)
+		pos = 0
+		while pos < len(data):
 
 			if self.hcruheader is None:
-				if avail_bytes < TrdHalfCruHeader.header_size:
-					# hdump.fromfile(stream, avail_bytes)
-				
+				# 256-bit padding words between half-CRU payloads
+				if data[pos:pos+32] == b'\xee'*32:
+					pos += 32
+					continue
+
+				if len(data) - pos < TrdHalfCruHeader.header_size:
 					raise ValueError("Insufficient data for Half-CRU header")
 
-				self.hcruheader = TrdHalfCruHeader.read(stream)
+				self.hcruheader = TrdHalfCruHeader(
+					data[pos:pos+TrdHalfCruHeader.header_size], addr+pos)
 				self.hexdump(self.hcruheader)
-				self.link = None
-				self.unread = None
-
-			if self.link is None:
+				pos += TrdHalfCruHeader.header_size
 				self.link = 0
-				self.unread = None
-
-			if self.unread is None:
-				self.unread = self.hcruheader.datasize[self.link]
+				self.unread = self.hcruheader.datasize[0]
 
-			if self.unread > 0:
-				avail = maxpos - stream.tell()
-				readsize = self.unread if self.unread < avail else avail
-				self.feeparser.read(stream,readsize)
+			readsize = min(self.unread, len(data) - pos)
+			if readsize > 0:
+				self.chunks.append((data[pos:pos+readsize], addr+pos))
 				self.unread -= readsize
+				pos += readsize
 
-			if self.unread == 0:
-				logger.info(f"DONE processing link {self.link}")
-				self.feeparser.reset() # start new link
-				if self.link < 14:
-					self.link += 1
-					self.unread = None
-				else:
-					self.hcruheader = None
-					self.link = None
-					self.unread = None
-				
-			# if self.hcruheader is None:
-			# 	logger.info(f"{maxpos - stream.tell()} padding bytes")
-				# hdump.fromfile(stream, maxpos - stream.tell())
-				# assert(False)
-				# stream.seek(maxpos-1)
-			
+			while self.hcruheader is not None and self.unread == 0:
+				self.parse_link()
 
+	def parse_link(self):
+		"""Pass the complete data of the current link to the FEE parser"""
 
-def check_dword(dword):
+		if len(self.chunks) == 1:
+			self.feeparser.parse_buffer(*self.chunks[0])
+		elif len(self.chunks) > 1:
+			# the link continues across RDH pages
+			self.feeparser.parse_buffer(
+				b"".join(c for c, a in self.chunks), self.chunks[0][1])
+		self.chunks = list()
 
-	ctx = dict()
+		if self.link < 14:
+			self.link += 1
+			self.unread = self.hcruheader.datasize[self.link]
+		else:
+			self.hcruheader = None
+			self.link = None
+			self.unread = None
+
+
+def check_dword(dword):
+	"""Print the parsers whose validation pattern accepts a dword"""
 
-	parsers = [ parse_tracklet, parse_eot, parse_eod,
+	parsers = [ parse_tracklet_hc_header, parse_legacy_tracklet,
+	  parse_eot, parse_eod, parse_cru_padding,
 	  parse_hc0, parse_hc1, parse_hc2, parse_hc3,
-	  parse_mcmhdr, parse_adcmask, parse_adcdata(-1,-1) ]
+	  parse_mcmhdr, parse_adcmask ]
 
 	for p in parsers:
-		try:
-			p(ctx,dword)
-		except AssertionError:
-			continue
+		if expect(p)(dword) is not None:
+			print(f"0x{dword:08X}: {p.__name__}")
 
 
 def make_trd_parser(has_cruheader, **kwargs):
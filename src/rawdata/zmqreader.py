@@ -2,17 +2,23 @@
 #
 
 import sys
+import asyncio
 import zmq
+import zmq.asyncio
 import numpy as np
 import argparse
 from struct import unpack
 import time
 import click
 import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from typing import NamedTuple
 from datetime import datetime
 
 from .header import TrdboxHeader
+from .trdfeeparser import make_trd_parser
 # from .trdfeeparser import TrdFeeParser, logflt
 # from .rawlogging import ColorFormatter
 # from .rawlogging import AddLocationFilter
@@ -38,13 +44,122 @@ class subevent_t(NamedTuple):
     payload: np.ndarray
 
 
+def subscribe(socket, equipments=None):
+    """Subscribe a SUB socket to all subevents, or to the given equipment types"""
+
+    magicbytes = np.array([0xDA7AFEED],dtype=np.uint32).tobytes()
+
+    if equipments is None:
+        socket.setsockopt(zmq.SUBSCRIBE, magicbytes)
+    else:
+        for eq in equipments:
+            filter = magicbytes + (eq).to_bytes(1,'little');
+            socket.setsockopt(zmq.SUBSCRIBE, filter)
+
+
+def decode_message(parsers, evno, data):
+    """Decode a message with one subevent and return it as event_t"""
+
+    header = TrdboxHeader(data)
+    header.hexdump()
+
+    start = header.header_size
+    payload = data[start:start+header.payload_size]
+
+    if header.equipment_type in parsers:
+        parser = parsers[header.equipment_type]
+        parser.set_event(evno)
+        parser.parse_buffer(payload, start)
+    elif len(parsers) > 0:
+        logger.warning(f"unhandled equipment type 0x{header.equipment_type:02x}")
+
+    # ignore trailing bytes after the last complete dword, like the parser
+    nbytes = memoryview(payload).nbytes
+    payload = np.frombuffer(payload, dtype=np.uint32, count=nbytes//4)
+    subevent = subevent_t(header.equipment_type, header.equipment_id, payload)
+    return event_t(header.timestamp, tuple([subevent]))
+
+
+class PipelineCounters:
+    """Message counters of the receive/decode pipeline"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.received = 0
+        self.decoded = 0
+        self.dropped = 0
+        self.failed = 0
+
+    def add(self, name, n=1):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + n)
+
+    def __str__(self):
+        return (f"received {self.received} messages, decoded {self.decoded}, "
+                f"dropped {self.dropped}, failed {self.failed}")
+
+
+class _LockedSink:
+    """Serialize the calls to a digit or tracklet sink from several threads"""
+
+    def __init__(self, sink, lock):
+        self.sink = sink
+        self.lock = lock
+        if hasattr(sink, 'store_mcm'):
+            self.store_mcm = self._store_mcm
+
+    def __call__(self, *args):
+        with self.lock:
+            self.sink(*args)
+
+    def _store_mcm(self, *args):
+        with self.lock:
+            self.sink.store_mcm(*args)
+
+
 class zmqreader:
     """Reader class for events distributed over ZeroMQ.
 
-    The class can be used as an iterator over events in the file."""
+    The class can be used as an iterator over events in the file.
+
+    Every message contains one subevent. Messages are received without
+    copying them, and the payloads are passed to the parsers as NumPy
+    views of the message buffers.
+
+    With queue_size > 0, process() runs a pipeline: a dedicated thread
+    receives the messages into a bounded queue, which is drained by
+    `jobs` decoder threads. The decoders are pure Python and share the GIL
+    and a locked sink, so several of them do not decode in parallel and
+    events can be stored out of order; they only keep the queue drained
+    while another thread waits. If the decoders fall behind, the policy
+    decides what happens to new messages:
+      block       : wait for space in the queue (nothing is dropped here,
+                    but the socket buffers fill up)
+      drop-oldest : drop the oldest message in the queue
+      sample      : once the queue is half full, only queue every
+                    `sample_every`-th message; drop messages if it is full
+    The number of received, decoded and dropped messages is kept in
+    `counters`, as well as the number of messages that could not be
+    decoded. Decoding errors are logged, the decoders continue with the
+    next message."""
 
+    policies = ("block", "drop-oldest", "sample")
 
-    def __init__(self, source, equipments=None):
+    def __init__(self, source, equipments=None, queue_size=0, policy="block",
+                 sample_every=10):
+
+        if policy not in self.policies:
+            raise ValueError(f"invalid queue policy '{policy}'")
+
+        self.filename = source
+        self.parsers = dict()
+        self.trd_parser_kwargs = dict()
+
+        self.queue_size = queue_size
+        self.policy = policy
+        self.sample_every = sample_every
+        self.counters = PipelineCounters()
+        self.stopped = threading.Event()
 
         #  Socket to talk to server
         self.context = zmq.Context()
@@ -53,32 +168,232 @@ class zmqreader:
         logging.info(f"Subscribing to ZeroMQ publisher at {source}")
         self.socket.connect(source)
 
-        # Subscribe to data feed
-        magicbytes = np.array([0xDA7AFEED],dtype=np.uint32).tobytes()
+        subscribe(self.socket, equipments)
+
+    def add_trd_parser(self, **kwargs):
+        self.trd_parser_kwargs = kwargs
+        self.parsers[0x10] = make_trd_parser(has_cruheader=False, **kwargs)
+
+    def process(self, skip_events=0, jobs=1, events=None):
+        """Receive and decode messages until the programme is interrupted"""
+
+        if events is not None:
+            logger.warning("event selection is not supported for ZeroMQ sources")
+
+        if self.queue_size > 0:
+            return self.process_pipeline(skip_events, jobs)
+
+        if jobs > 1:
+            logger.warning("parallel decoding of ZeroMQ sources needs a queue")
+
+        evno = 0
+        try:
+            while True:
+                data = self.receive()
+                if evno >= skip_events:
+                    self.process_message(evno, data)
+                evno += 1
+        except KeyboardInterrupt:
+            logger.info(f"ZeroMQ reader interrupted after {evno} messages")
+
+    def receive(self):
+        """Receive the next message and return its buffer as a memoryview"""
+        return self.socket.recv(copy=False).buffer
+
+    def process_pipeline(self, skip_events=0, workers=1):
+        """Receive and decode messages in separate threads until stop()"""
+
+        self.queue = queue.Queue(self.queue_size)
+        self.stopped.clear()
 
-        if equipments is None:
-            self.socket.setsockopt(zmq.SUBSCRIBE, magicbytes)
+        receiver = threading.Thread(target=self._receive_loop,
+                                    args=(skip_events,), daemon=True)
+        receiver.start()
+
+        # every decoder needs its own parsers, the sinks are shared
+        if workers == 1 or len(self.parsers) == 0:
+            parsers = [self.parsers] * workers
         else:
-            for eq in equipments:
-                filter = magicbytes + (eq).to_bytes(1,'little');
-                self.socket.setsockopt(zmq.SUBSCRIBE, filter)
+            lock = threading.Lock()
+            kwargs = dict(self.trd_parser_kwargs)
+            for k in ('store_digits', 'store_tracklets'):
+                if kwargs.get(k) is not None:
+                    kwargs[k] = _LockedSink(kwargs[k], lock)
+            parsers = [{0x10: make_trd_parser(has_cruheader=False, **kwargs)}
+                       for i in range(workers)]
+
+        decoders = [threading.Thread(target=self._decode_loop, args=(p,), daemon=True)
+                    for p in parsers]
+        for t in decoders:
+            t.start()
+
+        try:
+            while receiver.is_alive():
+                receiver.join(0.5)
+        except KeyboardInterrupt:
+            self.stop()
+            receiver.join()
+        finally:
+            # the decoders finish the queued messages and stop at None
+            for i in range(len(decoders)):
+                while any(t.is_alive() for t in decoders):
+                    try:
+                        self.queue.put(None, timeout=0.1)
+                        break
+                    except queue.Full:
+                        pass
+            for t in decoders:
+                t.join()
+            logger.info(f"ZeroMQ pipeline: {self.counters}")
+
+    def stop(self):
+        """Stop the pipeline of process_pipeline()"""
+        self.stopped.set()
+
+    def _receive_loop(self, skip_events):
+        evno = 0
+        while not self.stopped.is_set():
+            if self.socket.poll(100) == 0:
+                continue
+
+            data = self.receive()
+            self.counters.add('received')
+            if evno >= skip_events:
+                self._enqueue((evno, data))
+            evno += 1
+
+    def _enqueue(self, item):
+        if self.policy == "block":
+            while not self.stopped.is_set():
+                try:
+                    self.queue.put(item, timeout=0.1)
+                    return
+                except queue.Full:
+                    pass
+
+        elif self.policy == "drop-oldest":
+            while True:
+                try:
+                    self.queue.put_nowait(item)
+                    return
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.counters.add('dropped')
+                    except queue.Empty:
+                        pass
+
+        elif self.policy == "sample":
+            if 2*self.queue.qsize() >= self.queue_size \
+               and self.counters.received % self.sample_every != 0:
+                self.counters.add('dropped')
+                return
+
+            try:
+                self.queue.put_nowait(item)
+            except queue.Full:
+                self.counters.add('dropped')
+
+    def _decode_loop(self, parsers):
+        while True:
+            item = self.queue.get()
+            if item is None:
+                return
+            try:
+                self.process_message(*item, parsers=parsers)
+                self.counters.add('decoded')
+            except Exception as e:
+                logger.error(f"cannot decode message {item[0]}: {e!r}")
+                self.counters.add('failed')
+
+    def process_message(self, evno, data, parsers=None):
+        """Decode a message with one subevent"""
+
+        decode_message(self.parsers if parsers is None else parsers, evno, data)
 
     def __iter__(self):
         return self
 
     def __next__(self):
 
-        rawdata = self.socket.recv()
+        rawdata = self.receive()
 
         header = TrdboxHeader(rawdata)
+        header.hexdump()
         if header.equipment_type == 0x10:
-            payload = np.frombuffer(rawdata[header.header_size:], dtype=np.uint32)
+            payload = np.frombuffer(rawdata, dtype=np.uint32, offset=header.header_size)
 
             subevent = subevent_t(header.equipment_type, header.equipment_id, payload)
 
             return event_t(header.timestamp, tuple([subevent]))
 
         else:
-            raise ValueError(f"unhandled equipment type 0x{header.equipment_type:0x2}")
+            raise ValueError(f"unhandled equipment type 0x{header.equipment_type:02x}")
 
         # logging.info(header, end="")
+
+
+class AsyncZmqReader:
+    """asyncio reader for events distributed over ZeroMQ
+
+        async for event in AsyncZmqReader(["tcp://host1:7776", "tcp://host2:7776"]):
+            ...
+
+    The reader subscribes to one or several publishers with a single
+    socket, optionally only to the given equipment types. Every message is
+    decoded by the parsers (see add_trd_parser) in an executor, so the event
+    loop is not blocked. The default executor has a single thread, so the
+    parsers are never used concurrently. Every iteration yields an event_t
+    with one subevent."""
+
+    def __init__(self, sources, equipments=None, executor=None):
+
+        if isinstance(sources, str):
+            sources = [sources]
+
+        self.sources = list(sources)
+        self.parsers = dict()
+        self.evno = 0
+        self.executor = executor if executor is not None else ThreadPoolExecutor(1)
+
+        self.context = zmq.asyncio.Context.instance()
+        self.socket = self.context.socket(zmq.SUB)
+        for source in self.sources:
+            logger.info(f"Subscribing to ZeroMQ publisher at {source}")
+            self.socket.connect(source)
+
+        subscribe(self.socket, equipments)
+
+    def add_trd_parser(self, **kwargs):
+        self.parsers[0x10] = make_trd_parser(has_cruheader=False, **kwargs)
+
+    async def receive(self):
+        """Receive the next message and return its buffer as a memoryview"""
+        frame = await self.socket.recv(copy=False)
+        return frame.buffer
+
+    async def process(self, skip_events=0):
+        """Receive and decode messages until the task is cancelled"""
+
+        for i in range(skip_events):
+            await self.receive()
+            self.evno += 1
+
+        async for event in self:
+            pass
+
+    def close(self):
+        self.socket.close()
+        self.executor.shutdown(wait=False)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        data = await self.receive()
+        evno = self.evno
+        self.evno += 1
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(
+            self.executor, decode_message, self.parsers, evno, data)
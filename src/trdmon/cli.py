@@ -6,7 +6,9 @@ from . import dimwid
 # from . import trdbox
 from . import roc
 from . import dim
+from . import daq
 
+import click
 import logging
 import urwid
 import os
@@ -17,8 +19,10 @@ from collections import OrderedDict
 
 # ===========================================================================
 
-def cli():
-
+@click.command()
+@click.option('--daq', 'daq_sources', multiple=True, default=["tcp://localhost:7776"],
+              help="ZeroMQ publisher(s) to monitor, e.g. tcp://trdbox:7776")
+def cli(daq_sources):
 
     # set up logging to /tmp/trdmon-{username}.log
     username = pwd.getpwuid( os.getuid() )[ 0 ]
@@ -50,6 +54,7 @@ def cli():
             urwid.LineBox(roc.info(0,2,0)),
             # urwid.LineBox(dim.servers(dimservers)),
             dimservers,
+            urwid.LineBox(daq.rates(daq_sources)),
         ])), 'bg'),
         focus_part='header')
 
@@ -0,0 +1,57 @@
+import urwid
+import asyncio
+import logging
+import trdmon.dimwid as dimwid
+
+from rawdata.zmqreader import AsyncZmqReader
+from rawdata.digits import DigitSink
+
+class rates(urwid.Text):
+    """Live message and digit rates from the TRDbox ZeroMQ publisher"""
+
+    def __init__(self, sources="tcp://localhost:7776", interval=1.0):
+        super().__init__(("fsm:off", "DAQ: no data"))
+
+        self.interval = interval
+        self.messages = 0
+        self.bytes = 0
+        self.digits = 0
+
+        self.reader = AsyncZmqReader(sources, equipments=[0x10])
+        self.chunks = list()
+        self.sink = DigitSink(self.chunks.append)
+        self.reader.add_trd_parser(store_digits=self.sink)
+
+        dimwid.asyncio_event_loop.create_task(self.receive())
+        dimwid.asyncio_event_loop.create_task(self.refresh())
+
+    async def receive(self):
+        logger = logging.getLogger(__name__)
+        try:
+            async for event in self.reader:
+                # The reader decodes one message at a time, so the sink is
+                # idle until the next iteration. Count its digits here, on
+                # the event loop thread, where refresh() resets the counters.
+                self.sink.flush()
+                self.digits += sum(c.nrows for c in self.chunks)
+                self.chunks.clear()
+                self.messages += 1
+                self.bytes += sum(s.payload.nbytes for s in event.subevents)
+        except Exception as e:
+            logger.error(f"DAQ monitor stopped: {e}")
+
+    async def refresh(self):
+        while True:
+            await asyncio.sleep(self.interval)
+
+            if self.messages == 0:
+                self.set_text(("fsm:off", "DAQ: no data"))
+            else:
+                self.set_text(("fsm:ready",
+                    f"DAQ: {self.messages/self.interval:6.1f} msg/s "
+                    f"{self.bytes/self.interval/1e3:8.1f} kB/s "
+                    f"{self.digits/self.interval:8.0f} digits/s"))
+
+            self.messages = 0
+            self.bytes = 0
+            self.digits = 0
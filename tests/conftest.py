@@ -0,0 +1,15 @@
+# The packages live in src/, make them importable without installing them.
+# Caches and indices of all tests are kept in a temporary directory.
+
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, "src"))
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    path = tmp_path / "cache"
+    monkeypatch.setenv("PYTRD_CACHE_DIR", str(path))
+    return path
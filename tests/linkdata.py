@@ -0,0 +1,105 @@
+# Builders for the dwords of TRD link data, used by several tests
+#
+# The functions follow the data formats in the TRAP User Manual, i.e. the
+# patterns of the parsers in trdfeeparser.py, but are written out by hand
+# so that the tests do not depend on the decoding code.
+
+import numpy as np
+
+eot = 0x10001000  # end of tracklets
+eod = 0x00000000  # end of data
+
+
+def hc0(major=0x20, minor=0, nhw=1, sm=3, stack=2, layer=4, side=0):
+    return ((major<<24) | (minor<<17) | (nhw<<14) | (sm<<9) | (layer<<6)
+            | (stack<<3) | (side<<2) | 0b01)
+
+
+def hc1(ntb, bc=123, pretrigger=5, phase=3):
+    return (ntb<<26) | (bc<<10) | (pretrigger<<6) | (phase<<2) | 0b01
+
+
+def hc2(bits=0x3F):
+    # the upper bits look like the number of time bins of an HC1
+    return (bits<<26) | 0b110001
+
+
+def hc3(svn=4711):
+    return (svn<<15) | 0b110101
+
+
+def mcmhdr(rob, mcm, event=0):
+    return (1<<31) | (rob<<28) | (mcm<<24) | ((event & 0xFFFFF)<<4) | 0b1100
+
+
+def adcmask(channels, count=None):
+    mask = sum(1<<ch for ch in channels)
+    if count is None:
+        count = len(channels)
+    return ((~count & 0x1F)<<25) | (mask<<4) | 0b1100
+
+
+def adcwords(channel, adc):
+    """The dwords of one channel, with three 10-bit ADC values each"""
+
+    values = list(adc) + [0] * (-len(adc) % 3)
+    flag = 0b10 if channel % 2 else 0b11
+    return [(values[i]<<22) | (values[i+1]<<12) | (values[i+2]<<2) | flag
+            for i in range(0, len(values), 3)]
+
+
+def tracklet_hc(sm=3, stack=2, layer=4, side=0, fmt=1, time=0):
+    # sm, layer, stack and side are stored inverted
+    return ((fmt<<28) | (time<<13) | (1<<12) | ((~sm & 0x1F)<<7)
+            | ((~layer & 0x7)<<4) | ((~stack & 0x7)<<1) | (~side & 0x1))
+
+
+def tracklet_mcmhdr(row, col, pid=(0xFF, 0xFF, 0xFF)):
+    """MCM header for up to three tracklets, 0xFF marks a missing one"""
+    a, b, c = pid
+    return (1<<31) | (row<<27) | (col<<25) | (c<<17) | (b<<9) | (a<<1) | 0b1
+
+
+def tracklet_word(position, slope, pid=0):
+    # bit 3 of position and slope is stored inverted
+    return ((((position & 0x7FF) ^ 0x8)<<21) | ((pid & 0xFFF)<<9)
+            | (((slope & 0xFF) ^ 0x8)<<1))
+
+
+def legacy_tracklet(row, position, slope, pid=0):
+    return (pid<<24) | (row<<20) | ((slope & 0x7F)<<13) | (position & 0x1FFF)
+
+
+def link(rng, zs=True, ntb=30, nhw=1, mcms=((0, 0), (1, 3), (5, 15)),
+         tracklets=(), event=0, **hc):
+    """Data of one link with random ADC values
+
+    Returns the dwords and the expected digits as a list of tuples (rob,
+    mcm, channel, adc). Without zero suppression, all 21 channels are read
+    out, otherwise a random selection. `tracklets` are dwords that are put
+    before the end-of-tracklet markers."""
+
+    words = list(tracklets) + [eot, eot]
+    words.append(hc0(major=0x20 if zs else 0x10, nhw=nhw, **hc))
+    words += [hc1(ntb), hc2(), hc3()][:nhw]
+
+    digits = list()
+    for rob, mcm in mcms:
+        words.append(mcmhdr(rob, mcm, event))
+        if zs:
+            channels = np.flatnonzero(rng.random(21) < 0.4).tolist() or [0]
+            words.append(adcmask(channels))
+        else:
+            channels = range(21)
+
+        for ch in channels:
+            adc = rng.integers(0, 1024, size=ntb).tolist()
+            words += adcwords(ch, adc)
+            digits.append((rob, mcm, ch, adc))
+
+    words += [eod, eod]
+    return words, digits
+
+
+def tobytes(words):
+    return np.array(words, dtype="<u4").tobytes()
@@ -0,0 +1,34 @@
+import numpy as np
+import pytest
+
+from rawdata.minidaqreader import MiniDaqHeader
+from rawdata.tfreader import RawDataHeader
+from rawdata.trdfeeparser import TrdHalfCruHeader
+
+
+@pytest.mark.parametrize("header", [MiniDaqHeader, RawDataHeader, TrdHalfCruHeader])
+def test_unpack_array(header):
+    rng = np.random.default_rng(1)
+    data = rng.integers(0, 256, size=4096, dtype=np.uint8).tobytes()
+
+    # unaligned offsets, and the last header at the end of the buffer
+    offsets = [0, 3, 100, 1001, len(data) - header.header_size]
+    table = header.unpack_array(data, offsets)
+
+    assert table.dtype == header.dtype
+    assert len(table) == len(offsets)
+    for row, offset in zip(table, offsets):
+        values = header.unpack(data[offset:offset+header.header_size])
+        assert tuple(row[k] for k in header.keys()) == tuple(values)
+
+
+def test_no_offsets():
+    table = MiniDaqHeader.unpack_array(b"\0" * 100, [])
+    assert len(table) == 0
+    assert table.dtype == MiniDaqHeader.dtype
+
+
+@pytest.mark.parametrize("offset", [-1, 81])
+def test_offset_outside_buffer(offset):
+    with pytest.raises(ValueError):
+        MiniDaqHeader.unpack_array(b"\0" * 100, [0, offset])
@@ -0,0 +1,56 @@
+import bz2
+import numpy as np
+import pytest
+
+from rawdata.bz2stream import ParallelBZ2Reader, open_bz2
+
+
+def text(nlines, seed=1):
+    words = np.random.default_rng(seed).integers(0, 1<<32, size=nlines, dtype=np.uint64)
+    return "".join(f"0x{w:08x}\n" for w in words).encode()
+
+
+def read_all(filename, threads):
+    with ParallelBZ2Reader(filename, threads) as f:
+        return f.read()
+
+
+@pytest.fixture
+def multiblock(tmp_path):
+    # 100 kB blocks with compresslevel=1, i.e. several blocks
+    data = text(60000)
+    filename = tmp_path / "data.bz2"
+    filename.write_bytes(bz2.compress(data, compresslevel=1))
+    return str(filename), data
+
+
+@pytest.mark.parametrize("threads", [1, 3])
+def test_multiple_blocks(multiblock, threads):
+    filename, data = multiblock
+    with bz2.open(filename, "rb") as f:
+        assert f.read() == data
+    assert read_all(filename, threads) == data
+
+
+def test_concatenated_streams(tmp_path):
+    parts = [text(20000, seed) for seed in range(3)]
+    filename = tmp_path / "data.bz2"
+    filename.write_bytes(b"".join(bz2.compress(p, compresslevel=1) for p in parts))
+
+    with bz2.open(str(filename), "rb") as f:
+        expected = f.read()
+    assert expected == b"".join(parts)
+    assert read_all(str(filename), 2) == expected
+
+
+def test_empty_file(tmp_path):
+    filename = tmp_path / "empty.bz2"
+    filename.write_bytes(b"")
+    assert read_all(str(filename), 2) == b""
+
+
+def test_text_lines(multiblock):
+    filename, data = multiblock
+    with open_bz2(filename, threads=2) as f:
+        lines = list(f)
+    assert lines == data.decode().splitlines(keepends=True)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from rawdata.digits import DigitSink, DigitFileWriter, read_digits, digits_t
+
+
+def fill(sink, nevents=3, nmcm=5, ntb=30, seed=1):
+    """Store random digits of a few MCMs per event, return them as columns"""
+
+    rng = np.random.default_rng(seed)
+    rows = list()
+    for event in range(nevents):
+        for i in range(nmcm):
+            channels = np.flatnonzero(rng.random(21) < 0.5)
+            adc = rng.integers(0, 1024, size=(len(channels), ntb), dtype=np.uint16)
+            det, rob, mcm = 100 + event, i % 8, (3*i) % 16
+            sink.store_mcm(event, det, rob, mcm, channels, adc)
+            for ch, a in zip(channels, adc):
+                rows.append((event, det, rob, mcm, ch, a))
+    sink.flush()
+
+    return digits_t(*(np.array([r[k] for r in rows]) for k in range(5)),
+                    np.array([r[5] for r in rows]).reshape(-1, ntb))
+
+
+def concat(chunks):
+    return digits_t(*(np.concatenate(c) for c in zip(*chunks)))
+
+
+def test_sink_hands_out_one_chunk_per_event():
+    chunks = list()
+    expected = fill(DigitSink(chunks.append))
+
+    assert len(chunks) == 3
+    for event, chunk in enumerate(chunks):
+        assert (chunk.event == event).all()
+
+    for got, want in zip(concat(chunks), expected):
+        np.testing.assert_array_equal(got, want)
+
+
+def test_sink_with_chunk_size():
+    chunks = list()
+    expected = fill(DigitSink(chunks.append, chunk_size=40))
+
+    assert all(c.nrows >= 40 for c in chunks[:-1])
+    assert sum(c.nrows for c in chunks) == expected.nrows
+
+
+def test_file_roundtrip(tmp_path):
+    filename = str(tmp_path / "digits.bin")
+    writer = DigitFileWriter(filename)
+    expected = fill(DigitSink(writer, chunk_size=25))
+    writer.close()
+
+    digits = read_digits(filename)
+    assert digits.nrows == expected.nrows
+    assert digits.adc.shape == (expected.nrows, 30)
+    for got, want in zip(digits, expected):
+        np.testing.assert_array_equal(got, want)
+
+
+def test_file_without_digits(tmp_path):
+    filename = str(tmp_path / "digits.bin")
+    writer = DigitFileWriter(filename)
+    writer.close()
+
+    digits = read_digits(filename)
+    assert digits.nrows == 0
+    assert digits.adc.shape == (0, 0)
+
+
+def test_file_with_different_ntb(tmp_path):
+    writer = DigitFileWriter(str(tmp_path / "digits.bin"))
+    fill(DigitSink(writer), nevents=1, ntb=30)
+    with pytest.raises(ValueError):
+        fill(DigitSink(writer), nevents=1, ntb=24)
+
+
+def test_not_a_digits_file(tmp_path):
+    filename = tmp_path / "digits.bin"
+    filename.write_bytes(b"\0" * 256)
+    with pytest.raises(ValueError):
+        read_digits(str(filename))
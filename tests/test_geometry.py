@@ -0,0 +1,46 @@
+import numpy as np
+
+from rawdata.geometry import pad_coordinates, pad_table, ncolumn
+
+
+def test_table_matches_formulas():
+    # FeeParam::getPadRowFromMCM and getPadColFromADC in O2
+    for rob in range(8):
+        for mcm in range(16):
+            for channel in range(21):
+                padrow = 4*(rob//2) + mcm//4
+                padcol = 18*(mcm%4 + 4*(rob%2)) + 19 - channel
+                if not 0 <= padcol < 144:
+                    padcol = -1
+                assert tuple(pad_table[rob, mcm, channel]) == (padrow, padcol)
+
+
+def test_all_pads_are_connected():
+    padrow, padcol = pad_table[..., 0], pad_table[..., 1]
+    connected = padcol >= 0
+
+    pads = np.zeros((16, ncolumn), dtype=int)
+    np.add.at(pads, (padrow[connected], padcol[connected]), 1)
+    assert (pads > 0).all()
+
+
+def test_unconnected_channels():
+    # channel 0 of the rightmost and channel 20 of the leftmost MCMs
+    assert pad_coordinates(1, 3, 0)[1] == -1
+    assert pad_coordinates(0, 0, 20)[1] == -1
+    assert pad_coordinates(0, 0, 0)[1] == 19
+
+
+def test_arrays():
+    rob = np.array([0, 1, 7], dtype=np.uint8)
+    mcm = np.array([0, 5, 15], dtype=np.uint8)
+    channel = np.array([2, 10, 19], dtype=np.uint8)
+
+    padrow, padcol = pad_coordinates(rob, mcm, channel)
+    assert padrow.dtype == np.int16 and padcol.dtype == np.int16
+    np.testing.assert_array_equal(padrow, [0, 1, 15])
+    np.testing.assert_array_equal(padcol, [17, 18*5 + 9, 18*7 + 0])
+
+
+def test_table_is_read_only():
+    assert not pad_table.flags.writeable
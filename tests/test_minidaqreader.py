@@ -0,0 +1,21 @@
+import logging
+
+from rawdata.minidaqreader import MiniDaqHeader, minidaq_header
+
+
+def test_hexdump(caplog):
+    data = minidaq_header(0x10, 2, 8, sec=1600000000)
+    header = MiniDaqHeader(data, 0x100)
+
+    # nothing is formatted if the hexdump logger is disabled
+    with caplog.at_level(logging.WARNING):
+        header.hexdump()
+    assert caplog.records == []
+
+    with caplog.at_level(logging.INFO):
+        header.hexdump()
+
+    # one message with its own description for every dword
+    assert [r.hexaddr for r in caplog.records] == [0x100 + 4*i for i in range(5)]
+    assert caplog.records[0].getMessage() == "MiniDAQ magic word 0xda7afeed"
+    assert caplog.records[1].getMessage() == "equipment 10:02 header version v1"
@@ -0,0 +1,124 @@
+import os
+import numpy as np
+import pytest
+
+import rawdata.o32cache
+from rawdata.factory import make_reader
+from rawdata.minidaqreader import MiniDaqReader, MiniDaqHeader
+from rawdata.o32cache import O32Cache, O32CacheReader, convert_o32
+from rawdata.o32reader import o32reader
+
+
+def write_o32(filename, events):
+    """Write an o32 file, every event is a list of blocks of words"""
+
+    with open(filename, "w") as f:
+        for evno, blocks in enumerate(events):
+            f.write("# EVENT\n# format version: 1.0\n"
+                    f"# time stamp: 2019-01-01T12:00:{evno:02d}.000250\n")
+            f.write(f"# data blocks: {len(blocks)}\n")
+            for sfp, words in enumerate(blocks):
+                f.write(f"## DATA SEGMENT\n## sfp: {sfp}\n## size: {len(words)}\n")
+                f.writelines(f"0x{w:08x}\n" for w in words)
+
+
+def random_events(sizes, seed=1):
+    rng = np.random.default_rng(seed)
+    return [[rng.integers(0, 1<<32, size=n, dtype=np.uint64) for n in blocks]
+            for blocks in sizes]
+
+
+def subevents(reader, evno):
+    """Headers and payloads of the subevents of an event in a MiniDAQ file"""
+
+    data = reader.read(int(reader.index.offset[evno]), int(reader.index.size[evno]))
+    pos = MiniDaqHeader.header_size
+    while pos < len(data):
+        hdr = MiniDaqHeader(data[pos:pos+MiniDaqHeader.header_size], pos)
+        pos += hdr.header_size
+        yield hdr, np.frombuffer(data[pos:pos+hdr.payload_size], dtype=np.uint32)
+        pos += hdr.payload_size
+
+
+@pytest.fixture
+def o32file(tmp_path):
+    # the second event is larger than 64 kB
+    events = random_events([[100, 0, 30], [20000, 5]])
+    filename = str(tmp_path / "test.o32")
+    write_o32(filename, events)
+    return filename, events
+
+
+def test_convert(o32file, tmp_path):
+    source, events = o32file
+    target = str(tmp_path / "test.bin")
+    convert_o32(source, target)
+
+    reader = MiniDaqReader(target)
+    assert len(reader.index) == len(events)
+    for evno, blocks in enumerate(events):
+        assert reader.index.timestamp[evno] == pytest.approx(1546344000.00025 + evno)
+
+        subs = list(subevents(reader, evno))
+        assert len(subs) == len(blocks)
+        for sfp, ((hdr, payload), words) in enumerate(zip(subs, blocks)):
+            assert (hdr.equipment_type, hdr.equipment_id) == (0x10, sfp)
+            assert hdr.version == (2 if 4*len(words) > 0xFFFF else 1)
+            np.testing.assert_array_equal(payload, words)
+
+
+def test_cache_converts_once(o32file, cache_dir, monkeypatch):
+    source, events = o32file
+    cache = O32Cache()
+
+    target = cache.get(source)
+    assert os.path.dirname(target) == str(cache_dir)
+    assert os.path.exists(target)
+
+    def fail(source, target):
+        raise AssertionError("converted again")
+    monkeypatch.setattr(rawdata.o32cache, "convert_o32", fail)
+    assert cache.get(source) == target
+
+    reader = make_reader(source)
+    assert isinstance(reader, O32CacheReader)
+    assert reader.filename == target
+
+
+def test_cache_remembers_failures(o32file, cache_dir, monkeypatch):
+    source, events = o32file
+    calls = list()
+
+    def fail(source, target):
+        calls.append(source)
+        raise ValueError("event too large")
+    monkeypatch.setattr(rawdata.o32cache, "convert_o32", fail)
+
+    cache = O32Cache()
+    for i in range(2):
+        with pytest.raises(ValueError):
+            cache.get(source)
+    assert len(calls) == 1
+    assert os.path.exists(cache.path(source) + ".failed")
+    assert not os.path.exists(cache.path(source))
+
+    # make_reader falls back to reading the o32 file
+    assert isinstance(make_reader(source), o32reader)
+
+
+def test_cache_eviction(tmp_path, cache_dir):
+    sources = list()
+    for i in range(3):
+        sources.append(str(tmp_path / f"test{i}.o32"))
+        write_o32(sources[-1], random_events([[1000]], seed=i))
+
+    cache = O32Cache()
+    targets = [cache.get(s) for s in sources]
+    size = os.path.getsize(targets[0])
+    for i, t in enumerate(targets):
+        # eviction uses the access times, keep the modification times
+        os.utime(t, ns=(i*10**9, os.stat(t).st_mtime_ns))
+
+    cache.max_size = 2*size
+    cache.evict(keep=targets[0])
+    assert [os.path.exists(t) for t in targets] == [True, False, True]
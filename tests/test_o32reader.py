@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+
+from rawdata.o32reader import o32reader, parse_hex_block
+
+
+def per_line(text):
+    """The conversion that o32reader falls back to"""
+    return np.array([int(line, 0) for line in text.splitlines()], dtype=np.uint32)
+
+
+def random_words(n, seed=1):
+    return np.random.default_rng(seed).integers(0, 1<<32, size=n, dtype=np.uint64)
+
+
+@pytest.mark.parametrize("fmt", ["0x{:08x}\n", "0X{:08X}\n", "0x{:08X}\n"])
+def test_parse_hex_block(fmt):
+    text = "".join(fmt.format(w) for w in random_words(1000))
+    words = parse_hex_block(text, 1000)
+    assert words.dtype == np.uint32
+    np.testing.assert_array_equal(words, per_line(text))
+
+
+def test_short_lines():
+    text = "".join(f"0x{w:04x}\n" for w in random_words(100) & 0xFFFF)
+    np.testing.assert_array_equal(parse_hex_block(text, 100), per_line(text))
+
+
+@pytest.mark.parametrize("text, nlines", [
+    ("0x00000001\n0x2\n0x00000003\n", 3),  # different widths
+    ("0x0000000g\n", 1),                     # invalid digit
+    ("1x00000001\n", 1),                     # no 0x prefix
+    ("0x00000001 ", 1),                      # no newline
+    ("", 0),
+])
+def test_other_forms(text, nlines):
+    assert parse_hex_block(text, nlines) is None
+
+
+def write_o32(filename, blocks):
+    with open(filename, "w") as f:
+        f.write("# EVENT\n# format version: 1.0\n"
+                "# time stamp: 2019-01-01T12:00:00.000001\n")
+        f.write(f"# data blocks: {len(blocks)}\n")
+        for sfp, lines in enumerate(blocks):
+            f.write(f"## DATA SEGMENT\n## sfp: {sfp}\n## size: {len(lines)}\n")
+            f.writelines(lines)
+
+
+def test_reader_falls_back_to_single_lines(tmp_path):
+    words = random_words(50)
+    blocks = [[f"0x{w:08x}\n" for w in words],
+              [f"0x{w:x}\n" for w in words]]   # different widths
+    filename = str(tmp_path / "test.o32")
+    write_o32(filename, blocks)
+
+    reader = o32reader(filename)
+    (evno, line_number, text), = reader.split_events()
+    header, subevents = reader.read_event(line_number, text)
+
+    assert header['data blocks'] == 2
+    for sfp, sub in enumerate(subevents):
+        assert sub.equipment_id == sfp
+        assert sub.size == 4*len(words)
+        np.testing.assert_array_equal(sub.payload, words)
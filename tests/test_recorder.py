@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from rawdata.minidaqreader import MiniDaqReader, minidaq_header
+from rawdata.recorder import RotatingFileWriter, minidaq_event
+from rawdata.replay import subevents
+
+
+def messages(sizes, seed=1):
+    """TRDbox messages: a MiniDAQ header and a random payload"""
+
+    rng = np.random.default_rng(seed)
+    result = list()
+    for i, size in enumerate(sizes):
+        payload = rng.integers(0, 256, size=size, dtype=np.uint8).tobytes()
+        header = minidaq_header(0x10, i % 4, len(payload), 1600000000 + i, 1000*i)
+        result.append(header + payload)
+    return result
+
+
+def record(tmp_path, msgs, **kwargs):
+    writer = RotatingFileWriter(str(tmp_path / "rec-{index:02d}.bin"), **kwargs)
+    for msg in msgs:
+        writer.put(minidaq_event(memoryview(msg)))
+    writer.close()
+    return writer
+
+
+def replay(files):
+    result = list()
+    for filename in files:
+        reader = MiniDaqReader(filename, use_mmap=True)
+        for evno in range(len(reader.index)):
+            result.extend(bytes(m) for m in subevents(reader, evno))
+    return result
+
+
+def test_roundtrip(tmp_path):
+    # the last message needs a version 2 header
+    msgs = messages([0, 100, 4000, 70000])
+    writer = record(tmp_path, msgs)
+
+    assert writer.files == [str(tmp_path / "rec-00.bin")]
+    assert writer.events == len(msgs)
+    assert replay(writer.files) == msgs
+
+    reader = MiniDaqReader(writer.files[0])
+    np.testing.assert_allclose(reader.index.timestamp,
+                               [1600000000 + i + 1e-6*i for i in range(len(msgs))])
+    assert list(reader.index.equipments(3)) == [0x1003]
+
+
+def test_rotation(tmp_path):
+    msgs = messages([1000]*10)
+    writer = record(tmp_path, msgs, max_size=3500)
+
+    assert len(writer.files) == 4
+    assert replay(writer.files) == msgs
+
+
+def test_message_without_magic():
+    with pytest.raises(AssertionError):
+        minidaq_event(b"\0" * 32)
@@ -0,0 +1,126 @@
+import io
+import struct
+import numpy as np
+import pytest
+
+from rawdata import tfreader
+from rawdata.digits import DigitSink, digits_t
+from rawdata.tfreader import TimeFrameReader, RdhStreamParser
+from rawdata.trdfeeparser import TrdFeeParser, TrdCruParser
+
+
+def link_data(rng, nmcm=4, ntb=30):
+    """Zero-suppressed data of one link, padded to 256-bit words"""
+
+    words = [0x10001000, 0x10001000]  # end of tracklets
+    words += [0x20000000 | (1<<14) | (3<<9) | (4<<6) | (2<<3) | 1,  # HC0
+              (ntb<<26) | (123<<10) | (5<<6) | (3<<2) | 1]           # HC1
+    for k in range(nmcm):
+        words.append((1<<31) | ((k%8)<<28) | (((3*k)%16)<<24) | 0xC)
+        mask = int(rng.integers(1, 1<<21))
+        nchannels = bin(mask).count("1")
+        words.append(((~nchannels & 0x1F)<<25) | (mask<<4) | 0xC)
+        for ch in range(nchannels):
+            f = 2 if ch % 2 else 3
+            for tb in range(0, ntb, 3):
+                a, b, c = rng.integers(0, 1024, size=3)
+                words.append((int(a)<<22) | (int(b)<<12) | (int(c)<<2) | f)
+    words += [0, 0]  # end of data
+    words += [0xEEEEEEEE] * (-len(words) % 8)
+    return struct.pack(f"<{len(words)}I", *words)
+
+
+def rdh_pages(payload, pagesize=0x2000):
+    pages = list()
+    for i in range(0, len(payload), pagesize-64):
+        data = payload[i:i+pagesize-64]
+        size = 64 + len(data)
+        pages.append(struct.pack("<BBH4xHH", 6, 64, 0, size, size) + bytes(52) + data)
+    return b"".join(pages)
+
+
+def data_header(origin, subspec, tfcount, size):
+    return (struct.pack("<4sLLL", b"O2O2", 0x60, 0, 3)
+            + struct.pack("<8s4s4s", b"DataHead", b"", b"")
+            + b"RAWDATA".ljust(16, b"\0") + struct.pack("<4sL4sL", origin, 1, b"", 0)
+            + struct.pack("<LLQ", subspec, 0, size)
+            + struct.pack("<LLL4s", tfcount, tfcount, 0, b""))
+
+
+def concat(chunks):
+    return digits_t(*(np.concatenate(c) for c in zip(*chunks)))
+
+
+@pytest.fixture
+def tffile(tmp_path):
+    """A time frame file with TRD and TPC payloads, and the expected digits"""
+
+    rng = np.random.default_rng(1)
+    expected = list()
+    parser = TrdFeeParser(store_digits=DigitSink(expected.append))
+
+    filename = str(tmp_path / "test.tf")
+    with open(filename, "wb") as f:
+        for tf in range(3):
+            parser.set_event(tf)
+            body = b""
+            for trigger in range(2):
+                # some links without data
+                links = [link_data(rng) if i % 4 != 3 else b"" for i in range(15)]
+                for data in links:
+                    if len(data) > 0:
+                        parser.parse_buffer(data)
+                sizes = [len(data)//32 for data in links] + [0]
+                body += (struct.pack("<BBBBI", 6, 0, 0, 0, 0) + bytes(24)
+                         + struct.pack("<16H", *sizes) + b"".join(links) + b"\xee"*32)
+
+            payload = rdh_pages(body)
+            f.write(data_header(b"TPC", 1, tf, 50) + bytes(50))
+            f.write(data_header(b"TRD", 10, tf, len(payload)) + payload)
+
+    parser.ctx.store_digits.flush()
+    return filename, concat(expected)
+
+
+@pytest.mark.parametrize("use_mmap", [False, True])
+def test_trd_digits(tffile, use_mmap):
+    filename, expected = tffile
+
+    chunks = list()
+    sink = DigitSink(chunks.append)
+    reader = TimeFrameReader(filename, use_mmap=use_mmap)
+    reader.add_trd_parser(store_digits=sink)
+    reader.process()
+    sink.flush()
+
+    # the links span several RDH pages
+    assert reader.index.select("TRD")['datasize'].max() > 0x2000
+    assert expected.nrows > 0
+    for got, want in zip(concat(chunks), expected):
+        np.testing.assert_array_equal(got, want)
+
+
+def test_event_selection(tffile):
+    filename, expected = tffile
+
+    chunks = list()
+    sink = DigitSink(chunks.append)
+    reader = TimeFrameReader(filename)
+    reader.add_trd_parser(store_digits=sink)
+    reader.process(events=[1])
+    sink.flush()
+
+    digits = concat(chunks)
+    assert set(digits.event.tolist()) == {1}
+    assert digits.nrows == (expected.event == 1).sum()
+
+
+@pytest.mark.parametrize("datasize", [0, 32])
+def test_invalid_rdh_size(datasize):
+    page = struct.pack("<BBH4xHH", 6, 64, 0, datasize, datasize) + bytes(52)
+    parser = RdhStreamParser(TrdCruParser())
+
+    with pytest.raises(tfreader.DataError):
+        parser.parse(page + bytes(64), 0)
+    with pytest.raises(tfreader.DataError):
+        parser.read(io.BytesIO(page + bytes(64)), 128)
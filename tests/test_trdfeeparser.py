@@ -0,0 +1,149 @@
+import logging
+import numpy as np
+import pytest
+
+from rawdata.digits import DigitSink, digits_t
+from rawdata.trdfeeparser import (TrdFeeParser, expect, parse_eot,
+    parse_legacy_tracklet, parse_hc1, parse_hc2, parse_hc3)
+
+import linkdata
+from linkdata import eot, hc2, hc3, link, tobytes
+
+
+def decode(words, tracklet_format="run3", event=0):
+    """Parse the dwords of one link, return the digits"""
+
+    chunks = list()
+    sink = DigitSink(chunks.append)
+    parser = TrdFeeParser(store_digits=sink, tracklet_format=tracklet_format)
+    parser.set_event(event)
+    parser.parse_buffer(tobytes(words))
+    sink.flush()
+
+    if len(chunks) == 0:
+        return []
+    digits = digits_t(*(np.concatenate(c) for c in zip(*chunks)))
+    return [(int(d.event), int(d.det), int(d.rob), int(d.mcm), int(d.channel),
+             d.adc.tolist()) for d in (digits_t(*row) for row in zip(*digits))]
+
+
+def expected(digits, event=0, sm=3, stack=2, layer=4):
+    det = 30*sm + 6*stack + layer
+    return [(event, det, rob, mcm, ch, adc) for rob, mcm, ch, adc in digits]
+
+
+@pytest.mark.parametrize("zs", [True, False])
+@pytest.mark.parametrize("ntb", [30, 24, 20])
+def test_digits(zs, ntb):
+    rng = np.random.default_rng(ntb)
+    words, digits = link(rng, zs=zs, ntb=ntb, event=7)
+    assert decode(words, event=7) == expected(digits, event=7)
+
+
+@pytest.mark.parametrize("nhw", [1, 2, 3])
+def test_additional_hc_headers(nhw):
+    # HC2 and HC3 look like an HC1 with phase >= 12, and their upper bits
+    # like a different number of time bins
+    rng = np.random.default_rng(nhw)
+    words, digits = link(rng, ntb=24, nhw=nhw)
+    assert decode(words) == expected(digits)
+
+
+def test_hc_dispatch_order():
+    candidates = expect(parse_hc3, parse_hc2, parse_hc1)
+    assert candidates(hc2()) is parse_hc2
+    assert candidates(hc3()) is parse_hc3
+    assert candidates(linkdata.hc1(30)) is parse_hc1
+
+
+def test_eot_before_legacy_tracklets():
+    # legacy tracklets accept any dword, including the EOT marker
+    assert expect(parse_eot, parse_legacy_tracklet)(eot) is parse_eot
+
+    rng = np.random.default_rng(1)
+    for tracklets in ([], [0x12345678, 0x23456789]):
+        words, digits = link(rng, tracklets=tracklets)
+        assert decode(words, tracklet_format="run2") == expected(digits)
+
+        found = list()
+        parser = TrdFeeParser(tracklet_format="run2",
+                              store_tracklets=lambda *t: found.append(t))
+        parser.parse_buffer(tobytes(words))
+        assert len(found) == len(tracklets)
+
+
+def test_channel_count_mismatch(caplog):
+    rng = np.random.default_rng(2)
+    words, digits = link(rng, mcms=[(0, 0), (1, 3), (2, 5)])
+
+    # the mask of the second MCM announces one channel too many
+    pos = words.index(linkdata.mcmhdr(1, 3)) + 1
+    channels = [ch for ch in range(21) if words[pos] & (1 << (ch+4))]
+    words[pos] = linkdata.adcmask(channels, count=len(channels)+1)
+
+    with caplog.at_level(logging.ERROR):
+        result = decode(words)
+
+    # the data of the MCM is skipped until the next MCM header
+    assert result == expected(d for d in digits if d[:2] != (1, 3))
+    assert "channel count mismatch" in caplog.text
+
+
+def test_hexdump(caplog):
+    rng = np.random.default_rng(3)
+    words, digits = link(rng, ntb=20, nhw=2, tracklets=[0x12345678])
+
+    # hexdump categories are looked up when the parser is created
+    with caplog.at_level(logging.INFO, logger="rawlog.hexdump"):
+        decode(words, tracklet_format="run2")
+
+    # one message for every dword, in order
+    records = [r for r in caplog.records if hasattr(r, 'hexaddr')]
+    assert [r.hexaddr for r in records] == [4*i for i in range(len(words))]
+    assert [r.hexdata for r in records] == words
+
+
+def decode_tracklets(words, tracklet_format, event=0):
+    """Parse the dwords of one link, return the tracklets"""
+
+    found = list()
+    parser = TrdFeeParser(tracklet_format=tracklet_format,
+                          store_tracklets=lambda *t: found.append(t))
+    parser.set_event(event)
+    parser.parse_buffer(tobytes(words))
+    return found
+
+
+# extreme values of the signed position and slope, and a few in between
+run3_values = [(0, 0), (1, 1), (-1, -1), (1023, 127), (-1024, -128),
+               (-8, 8), (300, -100)]
+
+
+@pytest.mark.parametrize("position, slope", run3_values)
+def test_run3_tracklets(position, slope):
+    rng = np.random.default_rng(4)
+    row, col, hpid, lpid = 9, 2, 0x12, 0x345
+    tracklets = [linkdata.tracklet_hc(sm=17, stack=4, layer=5, side=1),
+                 linkdata.tracklet_mcmhdr(row, col, pid=(hpid, 0xFF, 0xFF)),
+                 linkdata.tracklet_word(position, slope, lpid)]
+    words, digits = link(rng, tracklets=tracklets)
+
+    hcid = 60*17 + 12*4 + 2*5 + 1
+    assert decode_tracklets(words, "run3", event=5) == [
+        (5, hcid, row, col, position, slope, (hpid << 12) | lpid)]
+
+
+@pytest.mark.parametrize("position, slope", [(0, 0), (1, 1), (-1, -1),
+    (4095, 63), (-4096, -64), (-8, 8), (1000, -30)])
+def test_legacy_tracklets(position, slope):
+    rng = np.random.default_rng(5)
+    tracklets = [linkdata.legacy_tracklet(7, position, slope, pid=200),
+                 linkdata.legacy_tracklet(15, 0, 0, pid=1)]
+    words, digits = link(rng, tracklets=tracklets,
+                         sm=17, stack=4, layer=5, side=1)
+
+    # the half-chamber is known from HC0, which follows the tracklets
+    hcid = 60*17 + 12*4 + 2*5 + 1
+    assert decode_tracklets(words, "run2", event=5) == [
+        (5, hcid, 7, -1, position, slope, 200),
+        (5, hcid, 15, -1, 0, 0, 1)]
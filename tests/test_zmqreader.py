@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+import pytest
+import zmq
+
+from rawdata.minidaqreader import minidaq_header
+from rawdata.zmqreader import decode_message, zmqreader
+
+
+def make_reader(policy, queue_size=4, **kwargs):
+    # nothing is published on this port, zmq connects in the background
+    reader = zmqreader("tcp://127.0.0.1:7999", queue_size=queue_size,
+                       policy=policy, **kwargs)
+    reader.queue = queue.Queue(queue_size)
+    return reader
+
+
+def enqueue(reader, n):
+    # like _receive_loop, without a socket
+    for evno in range(n):
+        reader.counters.add('received')
+        reader._enqueue((evno, b""))
+
+
+def queued(reader):
+    return [reader.queue.get_nowait()[0] for i in range(reader.queue.qsize())]
+
+
+def test_block():
+    reader = make_reader("block")
+    enqueue(reader, 4)
+
+    # the fifth message waits for space in the queue
+    t = threading.Thread(target=enqueue, args=(reader, 1))
+    t.start()
+    t.join(0.3)
+    assert t.is_alive()
+
+    assert reader.queue.get()[0] == 0
+    t.join(1)
+    assert not t.is_alive()
+    assert queued(reader) == [1, 2, 3, 0]
+    assert reader.counters.dropped == 0
+
+
+def test_drop_oldest():
+    reader = make_reader("drop-oldest")
+    enqueue(reader, 10)
+
+    assert queued(reader) == [6, 7, 8, 9]
+    assert reader.counters.dropped == 6
+
+
+def test_sample():
+    reader = make_reader("sample", sample_every=10)
+    enqueue(reader, 20)
+
+    # once the queue is half full, only every 10th message is queued
+    assert queued(reader) == [0, 1, 9, 19]
+    assert reader.counters.dropped == 16
+    assert reader.counters.received == 20
+
+
+def test_decoding_errors(monkeypatch):
+    context = zmq.Context()
+    socket = context.socket(zmq.PUB)
+    port = socket.bind_to_random_port("tcp://127.0.0.1")
+
+    reader = zmqreader(f"tcp://127.0.0.1:{port}", queue_size=2, policy="block")
+
+    def process_message(evno, data, parsers=None):
+        if evno % 2:
+            raise ValueError("corrupt data")
+        time.sleep(0.01)
+    monkeypatch.setattr(reader, "process_message", process_message)
+
+    pipeline = threading.Thread(target=reader.process, daemon=True)
+    pipeline.start()
+
+    message = minidaq_header(0x10, 0, 8) + bytes(8)
+    deadline = time.monotonic() + 10
+    while reader.counters.failed < 5 and time.monotonic() < deadline:
+        socket.send(message)
+        time.sleep(0.002)
+
+    reader.stop()
+    pipeline.join(5)
+    reader.context.destroy(linger=0)
+    context.destroy(linger=0)
+
+    assert not pipeline.is_alive()
+    assert reader.counters.failed >= 5
+    assert reader.counters.decoded >= 5
+
+
+@pytest.mark.parametrize("size", [0, 3, 8, 10])
+def test_decode_message(size):
+    data = minidaq_header(0x10, 2, size) + bytes(range(size))
+    event = decode_message({}, 0, memoryview(data))
+
+    subevent, = event.subevents
+    assert (subevent.equipment_type, subevent.equipment_id) == (0x10, 2)
+    assert subevent.payload.tobytes() == bytes(range(size - size%4))